@@ -1,11 +1,76 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import asyncio
 import os
+import uuid
+from src.artifacts import get_artifact_store
+from src.checkpoint import get_checkpoint_store
+from src.clients import get_client_pool
+from src.coalescing import SingleFlight, fingerprint
 from src.deep_research import DeepSearch
+from src.events import EventChannel
+from src.jobs import WorkerPool, get_job_store
+from src.metrics import RUNS_IN_FLIGHT, render_metrics
+from src.prefetch import PrefetchSessions
+from src.resilience import resilience_stats
+from src.scheduler import get_scheduler
+from src.search_cache import get_search_cache
+from src.semantic_cache import get_semantic_cache
 
-app = FastAPI()
+async def run_research_job(job_id: str, job: dict) -> dict:
+    """
+    Run a queued research job on a worker thread. Unless the job resumes a
+    given run, the job id doubles as the checkpoint run id, so a job re-queued
+    after a crash resumes where it stopped.
+    """
+    api_key = os.getenv("GEMINI_KEY")
+    if not api_key:
+        raise RuntimeError("Missing GEMINI_KEY environment variable")
+    return await execute_research(
+        api_key, job["query"], job["mode"], job["breadth"], job["depth"], run_id=job.get("run_id") or job_id,
+        limits=job.get("limits"), prefetched=job.get("prefetched"), deadline_seconds=job.get("deadline_seconds")
+    )
+
+worker_pool = WorkerPool(
+    run_research_job,
+    workers=int(os.getenv("RESEARCH_WORKERS", "2")),
+)
+
+# Identical requests that arrive while one is running share its result, and
+# its answer is reused for a few seconds after it finishes
+COALESCE_REUSE_SECONDS = float(os.getenv("COALESCE_REUSE_SECONDS", "10"))
+followup_flights = SingleFlight("followup", COALESCE_REUSE_SECONDS)
+research_flights = SingleFlight("research", COALESCE_REUSE_SECONDS)
+
+# /followup can start a run's first level while the user answers the questions;
+# /research waits up to PREFETCH_WAIT_SECONDS for it before researching
+PREFETCH_MAX_CALLS = int(os.getenv("PREFETCH_MAX_CALLS", "8"))
+PREFETCH_WAIT_SECONDS = float(os.getenv("PREFETCH_WAIT_SECONDS", "5"))
+prefetch_sessions = PrefetchSessions(ttl_seconds=float(os.getenv("PREFETCH_TTL", "600")))
+
+def warm_up():
+    """Create SDK clients and process-wide stores before the first request needs them"""
+    api_key = os.getenv("GEMINI_KEY")
+    if api_key and os.getenv("GEMINI_BACKEND", "gemini") in ("gemini", "record"):
+        get_client_pool().warm_up(api_key)
+    get_scheduler()
+    get_search_cache()
+    get_semantic_cache()
+    get_checkpoint_store()
+    get_artifact_store()
+    get_job_store()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(warm_up)
+    worker_pool.start()
+    yield
+    worker_pool.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS to handle preflight OPTIONS requests
 origins = ["*"]
@@ -25,18 +90,35 @@ class ResearchRequest(BaseModel):
 
 class FollowupRequest(BaseModel):
     query: str
+    prefetch: bool = False  # start researching the query while the questions are answered
+    mode: str = "balanced"
+    breadth: int = 3
 
 @app.post("/followup")
 async def get_followup_questions(request: FollowupRequest):
     api_key = os.getenv("GEMINI_KEY")
     if not api_key:
         raise HTTPException(status_code=500, detail="Missing GEMINI_KEY environment variable")
+    if request.prefetch:
+        validate_mode_and_breadth(request.mode, request.breadth)
     
-    try:
+    async def generate():
+        response = {}
+        if request.prefetch:
+            # The prefetch gets its own ledger, capped so an abandoned session costs little
+            prefetcher = DeepSearch(api_key, mode=request.mode, max_calls=PREFETCH_MAX_CALLS)
+            response["session"] = prefetch_sessions.start(prefetcher, request.query, request.breadth)
+
         # Create an instance of DeepSearch and use it to generate follow-up questions
         deep_search = DeepSearch(api_key)
-        followup_questions = deep_search.generate_follow_up_questions(request.query)
-        return {"questions": followup_questions}
+        followup_questions = await deep_search.generate_follow_up_questions(request.query)
+        return {"questions": followup_questions, **response}
+
+    key = {"query": request.query}
+    if request.prefetch:
+        key.update(mode=request.mode, breadth=request.breadth)
+    try:
+        return await followup_flights.run(fingerprint(key), generate)
     except Exception as e:
         print(f"Error generating followup questions: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -47,31 +129,46 @@ class CombinedResearchRequest(BaseModel):
     breadth: int = 3
     depth: int = 2
     followup_answers: list = []
+    background: bool = False  # enqueue as a job and return its id right away
+    run_id: str = None  # resume an interrupted run from its checkpoints
+    max_calls: int = None  # run limits; the tree is pruned to stay within them
+    max_tokens: int = None
+    max_seconds: float = None
+    session: str = None  # session token from /followup, to reuse its prefetched searches
+    deadline_seconds: float = None  # stop researching in time to report within this many seconds
 
-@app.post("/research")
-async def perform_research(request: CombinedResearchRequest):
-    # Log the exact values received from the frontend
-    print(f"Received research request with: query='{request.query}', mode='{request.mode}', breadth={request.breadth}, depth={request.depth}")
-    
+def validate_mode_and_breadth(mode: str, breadth: int):
+    """Reject a research mode or breadth that DeepSearch does not support"""
+    valid_modes = ["fast", "balanced", "comprehensive"]
+    if mode not in valid_modes:
+        raise HTTPException(status_code=400, detail=f"Invalid mode. Must be one of: {', '.join(valid_modes)}")
+    if breadth < 1 or breadth > 10:
+        raise HTTPException(status_code=400, detail="Breadth must be between 1 and 10")
+
+def validate_research_request(request: CombinedResearchRequest) -> str:
+    """Validate a research request and return the API key to use for it"""
     api_key = os.getenv("GEMINI_KEY")
     if not api_key:
         raise HTTPException(status_code=500, detail="Missing GEMINI_KEY environment variable")
     
-    # Validate mode
-    valid_modes = ["fast", "balanced", "comprehensive"]
-    if request.mode not in valid_modes:
-        raise HTTPException(status_code=400, detail=f"Invalid mode. Must be one of: {', '.join(valid_modes)}")
-    
-    # Validate breadth and depth
-    if request.breadth < 1 or request.breadth > 10:
-        raise HTTPException(status_code=400, detail="Breadth must be between 1 and 10")
+    validate_mode_and_breadth(request.mode, request.breadth)
     if request.depth < 1 or request.depth > 5:
         raise HTTPException(status_code=400, detail="Depth must be between 1 and 5")
-    
-    # Log the values being used for the research
-    print(f"Using values for research: mode='{request.mode}', breadth={request.breadth}, depth={request.depth}")
-    
-    # Combine the original query with followup answers if provided
+    if request.deadline_seconds is not None and request.deadline_seconds <= 0:
+        raise HTTPException(status_code=400, detail="Deadline must be a positive number of seconds")
+
+    return api_key
+
+def research_limits(request: CombinedResearchRequest) -> dict:
+    """Run limits given in a research request, as DeepSearch keyword arguments"""
+    return {
+        "max_calls": request.max_calls,
+        "max_tokens": request.max_tokens,
+        "max_seconds": request.max_seconds,
+    }
+
+def build_combined_query(request: CombinedResearchRequest) -> str:
+    """Combine the original query with followup answers if provided"""
     combined_query = request.query
     if request.followup_answers and len(request.followup_answers) > 0:
         questions_and_answers = "\n".join(
@@ -79,24 +176,216 @@ async def perform_research(request: CombinedResearchRequest):
         )
         combined_query = f"Initial query: {request.query}\n\nFollow up questions and answers: {questions_and_answers}"
         print(f"Combined query with followup answers: {combined_query}")
+    return combined_query
+
+@app.post("/research")
+async def perform_research(request: CombinedResearchRequest):
+    # Log the exact values received from the frontend
+    print(f"Received research request with: query='{request.query}', mode='{request.mode}', breadth={request.breadth}, depth={request.depth}")
     
-    deep_search = DeepSearch(api_key, mode=request.mode)
-    try:
+    api_key = validate_research_request(request)
+    
+    # Log the values being used for the research
+    print(f"Using values for research: mode='{request.mode}', breadth={request.breadth}, depth={request.depth}")
+    
+    combined_query = build_combined_query(request)
+    
+    if request.background:
+        # Prefetch sessions belong to this event loop, so the job takes the
+        # searches that finished by now rather than waiting on the rest
+        prefetched = await prefetch_sessions.claim(request.session)
+        job_id = await asyncio.to_thread(get_job_store().enqueue, {
+            "query": combined_query,
+            "mode": request.mode,
+            "breadth": request.breadth,
+            "depth": request.depth,
+            "limits": research_limits(request),
+            "deadline_seconds": request.deadline_seconds,
+            "run_id": request.run_id,
+            "prefetched": prefetched,
+        })
+        worker_pool.notify()
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+
+    async def research():
+        run_id = request.run_id or str(uuid.uuid4())
+        try:
+            prefetched = await prefetch_sessions.claim(request.session, PREFETCH_WAIT_SECONDS)
+            return await execute_research(
+                api_key, combined_query, request.mode, request.breadth, request.depth, run_id=run_id,
+                limits=research_limits(request), prefetched=prefetched,
+                deadline_seconds=request.deadline_seconds
+            )
+        except Exception as e:
+            # The run id lets the caller resume from the checkpoints written so far
+            raise HTTPException(status_code=500, detail={"error": str(e), "run_id": run_id})
+
+    key = fingerprint({
+        "query": request.query,
+        "followup_answers": request.followup_answers,
+        "mode": request.mode,
+        "breadth": request.breadth,
+        "depth": request.depth,
+        "limits": research_limits(request),
+        "deadline_seconds": request.deadline_seconds,
+        "run_id": request.run_id,
+    })
+    return await research_flights.run(key, research)
+
+async def execute_research(api_key: str, query: str, mode: str, breadth: int, depth: int, run_id: str = None,
+                           limits: dict = None, prefetched: dict = None, deadline_seconds: float = None) -> dict:
+    """Run the research tree and return the final report with its run id, usage and coverage"""
+    deep_search = DeepSearch(api_key, mode=mode, **(limits or {}))
+    with RUNS_IN_FLIGHT.track_inprogress():
         results = await deep_search.deep_research(
-            query=combined_query, 
-            breadth=request.breadth, 
-            depth=request.depth, 
+            query=query, 
+            breadth=breadth, 
+            depth=depth, 
             learnings=[], 
-            visited_urls={}
+            visited_urls={},
+            run_id=run_id,
+            prefetched=prefetched,
+            deadline_seconds=deadline_seconds
         )
-        final_report = deep_search.generate_final_report(
-            query=combined_query, 
+        final_report = await deep_search.generate_final_report(
+            query=query, 
             learnings=results["learnings"], 
-            visited_urls=results["visited_urls"]
+            visited_urls=results["visited_urls"],
+            tree=results["tree"],
+            learning_sources=results["learning_sources"]
         )
-        return {"result": final_report}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    await asyncio.to_thread(
+        deep_search.artifacts.save, results["run_id"], {"report": final_report, "usage": deep_search.usage.totals()}
+    )
+    return {
+        "result": final_report,
+        "run_id": results["run_id"],
+        "usage": deep_search.usage.totals(),
+        "coverage": results["coverage"],
+    }
+
+@app.get("/research/{job_id}")
+async def get_research_job(job_id: str):
+    """Status and, once finished, result of a background research job"""
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown research job")
+    return job
+
+@app.get("/research/{run_id}/tree")
+async def get_research_tree(run_id: str):
+    """Stored research tree of a finished run"""
+    artifact = await asyncio.to_thread(get_artifact_store().load, run_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Unknown research run")
+    return {"run_id": run_id, "query": artifact.get("query"), "tree": artifact.get("tree")}
+
+@app.get("/artifacts")
+async def list_artifacts(limit: int = 50):
+    """Index of the stored research artifacts, most recent first"""
+    store = get_artifact_store()
+    return {"runs": await asyncio.to_thread(store.list, limit), **store.stats()}
+
+@app.post("/research/stream")
+async def stream_research(request: CombinedResearchRequest):
+    """
+    Run a research request and stream its progress as Server-Sent Events:
+    query_started, learning_added, query_completed, sources_discovered,
+    report_chunk and finally done (or error).
+    """
+    print(f"Received streaming research request with: query='{request.query}', mode='{request.mode}', breadth={request.breadth}, depth={request.depth}")
+
+    api_key = validate_research_request(request)
+    combined_query = build_combined_query(request)
+
+    run_id = request.run_id or str(uuid.uuid4())
+    channel = EventChannel()
+    deep_search = DeepSearch(api_key, mode=request.mode, **research_limits(request))
+    deep_search.add_listener(channel.publish)
+
+    async def run():
+        RUNS_IN_FLIGHT.inc()
+        try:
+            prefetched = await prefetch_sessions.claim(request.session, PREFETCH_WAIT_SECONDS)
+            results = await deep_search.deep_research(
+                query=combined_query,
+                breadth=request.breadth,
+                depth=request.depth,
+                learnings=[],
+                visited_urls={},
+                run_id=run_id,
+                prefetched=prefetched,
+                deadline_seconds=request.deadline_seconds
+            )
+            report_parts = []
+            async for chunk in deep_search.generate_final_report_stream(
+                query=combined_query,
+                learnings=results["learnings"],
+                visited_urls=results["visited_urls"],
+                tree=results["tree"],
+                learning_sources=results["learning_sources"]
+            ):
+                report_parts.append(chunk)
+                await channel.send({"type": "report_chunk", "text": chunk})
+            await asyncio.to_thread(
+                deep_search.artifacts.save, run_id,
+                {"report": "".join(report_parts), "usage": deep_search.usage.totals()}
+            )
+            await channel.send({"type": "done", "usage": deep_search.usage.totals(), "coverage": results["coverage"]})
+        except Exception as e:
+            print(f"Error during streaming research: {str(e)}")
+            await channel.send({"type": "error", "detail": str(e)})
+        finally:
+            RUNS_IN_FLIGHT.dec()
+            channel.close()
+
+    async def event_stream():
+        # Send something right away so clients and proxies see the stream open
+        channel.publish({"type": "research_started", "query": combined_query, "run_id": run_id})
+        task = asyncio.create_task(run())
+        try:
+            async for message in channel.stream():
+                yield message
+        finally:
+            # The client went away, stop spending quota on the run
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Queue depth, admissions and wait times of the shared model scheduler"""
+    return get_scheduler().stats()
+
+@app.get("/resilience/stats")
+async def model_resilience_stats():
+    """Circuit breaker state per model and hedged request counters"""
+    return resilience_stats()
+
+@app.get("/jobs/stats")
+async def job_stats():
+    """Number of background research jobs per status"""
+    return {"workers": worker_pool.workers, "jobs": await asyncio.to_thread(get_job_store().counts)}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters and size of the search and planning caches, and prefetch sessions"""
+    return {
+        "search": get_search_cache().stats(),
+        "planning": get_semantic_cache().stats(),
+        "prefetch": prefetch_sessions.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-phase calls, latency and errors, runs and tasks in flight"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,132 @@
+"""
+Offline benchmarks for DeepSearch.
+
+Runs deep_research followed by generate_final_report over a grid of
+breadth x depth x mode against a SyntheticBackend, so no API key or network
+is needed. For every case it reports wall time, model calls made, peak
+Python memory and effective concurrency (busy model time / wall time).
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_deep_research --breadth 2 4 --depth 1 2 --latency 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from src.backends import SyntheticBackend
+from src.checkpoint import CheckpointStore
+from src.clients import content
+from src.deep_research import DeepSearch
+from src.search_cache import SearchCache
+from src.semantic_cache import SemanticCache
+
+
+QUERY = "What are the economic and societal effects of AI adoption over the next decade?"
+
+
+async def run_case(mode: str, breadth: int, depth: int, args, workdir: str) -> dict:
+    backend = SyntheticBackend(
+        latency_median=args.latency,
+        latency_sigma=args.sigma,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    deep_search = DeepSearch("offline", mode=mode, backend=backend, report_synthesis=args.report_synthesis)
+
+    # Fresh caches per case, so every case pays for its own calls
+    case = f"{mode}-{breadth}-{depth}"
+    deep_search.search_cache = SearchCache(os.path.join(workdir, f"{case}-search.sqlite3"))
+    deep_search.planning_cache = SemanticCache()
+    deep_search.checkpoints = CheckpointStore(os.path.join(workdir, f"{case}-checkpoints.sqlite3"))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = await deep_search.deep_research(QUERY, breadth, depth, [], {})
+        research_done = time.perf_counter()
+        report = await deep_search.generate_final_report(
+            QUERY, results["learnings"], results["visited_urls"],
+            tree=results["tree"], learning_sources=results["learning_sources"])
+    end = time.perf_counter()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = backend.stats()
+    wall = end - start
+    return {
+        "mode": mode,
+        "breadth": breadth,
+        "depth": depth,
+        "wall_seconds": wall,
+        "research_seconds": research_done - start,
+        "report_seconds": end - research_done,
+        "calls": sum(stats["calls"].values()),
+        "calls_by_kind": stats["calls"],
+        "errors": stats["errors"],
+        "learnings": len(results["learnings"]),
+        "sources": len(results["visited_urls"]),
+        "report_chars": len(report),
+        "peak_memory_mb": peak_memory / 1e6,
+        "peak_in_flight": stats["peak_in_flight"],
+        "effective_concurrency": stats["busy_seconds"] / wall if wall else 0.0,
+    }
+
+
+def print_table(rows: list):
+    header = f"{'mode':<14}{'b':>3}{'d':>3}{'wall s':>9}{'research s':>12}{'report s':>10}" \
+             f"{'calls':>7}{'errors':>8}{'peak MB':>9}{'in-flight':>11}{'eff. conc.':>12}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['mode']:<14}{row['breadth']:>3}{row['depth']:>3}"
+            f"{row['wall_seconds']:>9.2f}{row['research_seconds']:>12.2f}{row['report_seconds']:>10.2f}"
+            f"{row['calls']:>7}{row['errors']:>8}{row['peak_memory_mb']:>9.2f}"
+            f"{row['peak_in_flight']:>11}{row['effective_concurrency']:>12.2f}"
+        )
+
+
+async def main(args):
+    # Load the SDK schema types up front so the first case does not pay for the import
+    content.Schema
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="deep-research-bench-") as workdir:
+        # Keep process-wide stores and run artifacts out of the source tree
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for mode in args.modes:
+                for breadth in args.breadth:
+                    for depth in args.depth:
+                        rows.append(await run_case(mode, breadth, depth, args, workdir))
+        finally:
+            os.chdir(cwd)
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark deep_research against a synthetic backend")
+    parser.add_argument("--breadth", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--depth", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--modes", nargs="+", choices=["fast", "balanced", "comprehensive"],
+                        default=["fast", "balanced", "comprehensive"])
+    parser.add_argument("--latency", type=float, default=0.2, help="Median model latency in seconds")
+    parser.add_argument("--sigma", type=float, default=0.4, help="Log-normal latency spread")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability that a call fails")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report-synthesis", choices=["auto", "single", "map_reduce"], default="auto",
+                        help="How the final report is written")
+    parser.add_argument("--json", type=str, help="Also write the results to this JSON file")
+
+    asyncio.run(main(parser.parse_args()))
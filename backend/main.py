@@ -3,33 +3,14 @@ import asyncio
 import os
 import time
 
+from src.checkpoint import get_checkpoint_store
 from src.deep_research import DeepSearch
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Run deep search queries')
-    parser.add_argument('query', type=str, help='The search query')
-    parser.add_argument('--mode', type=str, choices=['fast', 'balanced', 'comprehensive'],
-                        default='balanced', help='Research mode (default: balanced)')
-    parser.add_argument('--num-queries', type=int, default=3,
-                        help='Number of queries to generate (default: 3)')
-    parser.add_argument('--learnings', nargs='*', default=[],
-                        help='List of previous learnings')
-
-    args = parser.parse_args()
-
-    # Start the timer
-    start_time = time.time()
-
-    # Get API key from environment variable
-    api_key = os.getenv('GEMINI_KEY')
-    if not api_key:
-        raise ValueError("Please set GEMINI_KEY environment variable")
-
-    deep_search = DeepSearch(api_key, mode=args.mode)
-
-    breadth_and_depth = deep_search.determine_research_breadth_and_depth(
-        args.query)
+async def plan_research(deep_search: DeepSearch, query: str):
+    """Pick breadth and depth and fold the user's follow-up answers into the query"""
+    breadth_and_depth = await deep_search.determine_research_breadth_and_depth(
+        query)
 
     breadth = breadth_and_depth["breadth"]
     depth = breadth_and_depth["depth"]
@@ -41,7 +22,7 @@ if __name__ == "__main__":
 
     print("To better understand your research needs, please answer these follow-up questions:")
 
-    follow_up_questions = deep_search.generate_follow_up_questions(args.query)
+    follow_up_questions = await deep_search.generate_follow_up_questions(query)
 
     # get answers to the follow up questions
     answers = []
@@ -55,36 +36,110 @@ if __name__ == "__main__":
     questions_and_answers = "\n".join(
         [f"{answer['question']}: {answer['answer']}" for answer in answers])
 
-    combined_query = f"Initial query: {args.query}\n\n Follow up questions and answers: {questions_and_answers}"
+    combined_query = f"Initial query: {query}\n\n Follow up questions and answers: {questions_and_answers}"
 
     print(f"\nHere is the combined query: {combined_query}\n\n")
 
+    return combined_query, breadth, depth
+
+
+async def run(deep_search: DeepSearch, query: str, run_id: str = None, resume: dict = None,
+              deadline_seconds: float = None) -> str:
+    if resume:
+        combined_query, breadth, depth = resume["query"], resume["breadth"], resume["depth"]
+    else:
+        combined_query, breadth, depth = await plan_research(deep_search, query)
+
     print("Starting research... \n")
 
     # Run the deep research
-    results = asyncio.run(deep_search.deep_research(
+    results = await deep_search.deep_research(
         query=combined_query,
         breadth=breadth,
         depth=depth,
         learnings=[],
-        visited_urls={}
-    ))
-
-    # Generate and print the final report
-    final_report = deep_search.generate_final_report(
+        visited_urls={},
+        run_id=run_id,
+        deadline_seconds=deadline_seconds
+    )
+    coverage = results["coverage"]
+    if coverage["deadline_reached"]:
+        print(f"\nDeadline reached: {len(coverage['finished'])} of {coverage['total']} queries finished, "
+              f"{len(coverage['failed'])} failed, {len(coverage['cancelled'])} cancelled, "
+              f"{len(coverage['pruned'])} not started")
+    print(f"\nResearch run id: {results['run_id']} (resume with --resume {results['run_id']})\n")
+
+    # Stream the final report to the terminal as it is generated
+    print("\nFinal Research Report:")
+    print("=====================")
+    report_parts = []
+    async for chunk in deep_search.generate_final_report_stream(
         query=combined_query,
         learnings=results["learnings"],
-        visited_urls=results["visited_urls"]
-    )
+        visited_urls=results["visited_urls"],
+        tree=results["tree"],
+        learning_sources=results["learning_sources"]
+    ):
+        print(chunk, end="", flush=True)
+        report_parts.append(chunk)
+    print()
+
+    usage = deep_search.usage.totals()
+    print(f"\nModel usage: {usage['calls']} calls, {usage['total_tokens']} tokens")
+
+    report = "".join(report_parts)
+    await asyncio.to_thread(deep_search.artifacts.save, results["run_id"], {"report": report, "usage": usage})
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run deep search queries')
+    parser.add_argument('query', type=str, nargs='?', help='The search query')
+    parser.add_argument('--mode', type=str, choices=['fast', 'balanced', 'comprehensive'],
+                        default='balanced', help='Research mode (default: balanced)')
+    parser.add_argument('--num-queries', type=int, default=3,
+                        help='Number of queries to generate (default: 3)')
+    parser.add_argument('--learnings', nargs='*', default=[],
+                        help='List of previous learnings')
+    parser.add_argument('--resume', type=str, metavar='RUN_ID',
+                        help='Resume an interrupted research run from its checkpoints')
+    parser.add_argument('--max-calls', type=int, help='Limit on model calls for the run')
+    parser.add_argument('--max-tokens', type=int, help='Limit on model tokens for the run')
+    parser.add_argument('--max-seconds', type=float, help='Limit on wall-clock seconds for the run')
+    parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                        help='Stop researching in time to write the report within this many seconds')
+
+    args = parser.parse_args()
+
+    # Start the timer
+    start_time = time.time()
+
+    # Get API key from environment variable
+    api_key = os.getenv('GEMINI_KEY')
+    if not api_key:
+        raise ValueError("Please set GEMINI_KEY environment variable")
+
+    resume = None
+    if args.resume:
+        resume = get_checkpoint_store().get_run(args.resume)
+        if resume is None:
+            raise ValueError(f"No checkpointed research run with id {args.resume}")
+        args.mode = resume["mode"]
+    elif not args.query:
+        parser.error("a query is required unless --resume is given")
+
+    deep_search = DeepSearch(api_key, mode=args.mode, max_calls=args.max_calls,
+                             max_tokens=args.max_tokens, max_seconds=args.max_seconds)
+
+    # Run the whole interactive flow on a single event loop
+    final_report = asyncio.run(run(deep_search, args.query, run_id=args.resume, resume=resume,
+                                   deadline_seconds=args.deadline))
 
     # Calculate elapsed time
     elapsed_time = time.time() - start_time
     minutes = int(elapsed_time // 60)
     seconds = int(elapsed_time % 60)
 
-    print("\nFinal Research Report:")
-    print("=====================")
-    print(final_report)
     print(f"\nTotal research time: {minutes} minutes and {seconds} seconds")
 
     # Save the report to a file
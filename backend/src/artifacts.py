@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ArtifactStore:
+    """
+    Per-run research artifacts kept as gzipped JSON files.
+
+    Each run gets one file named after its run id, holding the research
+    tree, learnings, sources and, once written, the report. A SQLite index
+    records the query, size and timestamps of every artifact for listing
+    and lookup. When the artifacts grow past `max_bytes`, the least recently
+    updated ones are deleted. Calls block on disk I/O, so async code should
+    run them on a thread.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS artifacts (
+                run_id TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_updated ON artifacts (updated_at)")
+        self._conn.commit()
+
+    def _path(self, run_id: str) -> str:
+        # Run ids come from clients, so keep them from escaping the directory;
+        # the hash keeps ids that sanitize alike, such as "a.b" and "a_b", apart
+        safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in run_id[:64])
+        digest = hashlib.sha256(run_id.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{safe}-{digest}.json.gz")
+
+    def _read(self, run_id: str):
+        try:
+            with gzip.open(self._path(run_id), "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, run_id: str, artifact: dict) -> int:
+        path = self._path(run_id)
+        data = gzip.compress(json.dumps(artifact).encode("utf-8"))
+        # Write and rename, so readers never see a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return len(data)
+
+    def save(self, run_id: str, artifact: dict):
+        """Store the artifact of a run, merged into what is already stored for it"""
+        with self._lock:
+            merged = {**(self._read(run_id) or {}), **artifact}
+            size = self._write(run_id, merged)
+            now = time.time()
+            self._conn.execute(
+                """
+                INSERT INTO artifacts VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (run_id) DO UPDATE SET query = excluded.query, size = excluded.size,
+                    updated_at = excluded.updated_at
+                """,
+                (run_id, merged.get("query", ""), size, now, now),
+            )
+            self._conn.commit()
+            self._enforce_retention()
+
+    def _enforce_retention(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Keep the newest artifact even if it alone is over the limit
+        rows = self._conn.execute("SELECT run_id, size FROM artifacts ORDER BY updated_at ASC").fetchall()
+        evicted = []
+        for run_id, size in rows[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(run_id))
+            except FileNotFoundError:
+                pass
+            evicted.append((run_id,))
+            total -= size
+        self._conn.executemany("DELETE FROM artifacts WHERE run_id = ?", evicted)
+        self._conn.commit()
+
+    def load(self, run_id: str):
+        """Return the stored artifact of a run, or None"""
+        with self._lock:
+            return self._read(run_id)
+
+    def list(self, limit: int = 50) -> list[dict]:
+        """Index entries of the most recently updated artifacts"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id, query, size, created_at, updated_at FROM artifacts ORDER BY updated_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"run_id": run_id, "query": query, "size": size, "created_at": created_at, "updated_at": updated_at}
+            for run_id, query, size, created_at, updated_at in rows
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts"
+            ).fetchone()
+        return {"artifacts": count, "bytes": total, "max_bytes": self.max_bytes}
+
+
+_artifact_store = None
+_artifact_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """Return the process-wide artifact store, capped at ARTIFACT_MAX_BYTES"""
+    global _artifact_store
+    with _artifact_store_lock:
+        if _artifact_store is None:
+            _artifact_store = ArtifactStore(
+                os.getenv("ARTIFACT_PATH", os.path.join(".cache", "artifacts")),
+                int(os.getenv("ARTIFACT_MAX_BYTES", str(512 * 1024 * 1024))),
+            )
+        return _artifact_store
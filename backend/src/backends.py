@@ -0,0 +1,379 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from .clients import content, get_client_pool
+
+
+class LLMResponse:
+    """Text of a model response together with its dict representation"""
+
+    __slots__ = ("text", "raw")
+
+    def __init__(self, text: str, raw: dict):
+        self.text = text
+        self.raw = raw
+
+
+class GeminiBackend:
+    """
+    Model backend talking to the Gemini API.
+
+    Backends expose blocking `generate`, `generate_grounded` and
+    `generate_stream` methods; LLMClient runs them on its worker pool.
+    Clients and model handles come from the process-wide ClientPool.
+    """
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.clients = get_client_pool()
+
+    def generate(self, prompt: str, generation_config: dict, model_name: str) -> LLMResponse:
+        model = self.clients.model(self.api_key, model_name)
+        response = model.generate_content(prompt, generation_config=generation_config)
+        return LLMResponse(response.text, response.to_dict())
+
+    def generate_stream(self, prompt: str, generation_config: dict, model_name: str):
+        model = self.clients.model(self.api_key, model_name)
+        for chunk in model.generate_content(prompt, generation_config=generation_config, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks carrying only metadata (e.g. the finish reason) have no text
+                text = ""
+            yield LLMResponse(text, chunk.to_dict())
+
+    def generate_grounded(self, prompt: str, generation_config: dict, model_name: str) -> LLMResponse:
+        from google.genai import types
+
+        config = dict(generation_config)
+        config["tools"] = [types.Tool(google_search=types.GoogleSearch())]
+        client = self.clients.client(self.api_key)
+        response = client.models.generate_content(
+            model=model_name,
+            contents=prompt,
+            config=config
+        )
+        return LLMResponse(response.text, response.model_dump())
+
+
+def _record_key(kind: str, model_name: str, prompt: str) -> str:
+    return hashlib.sha256(f"{kind}\0{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+# Search results in learning extraction prompts, as DeepSearch.process_result
+# and DeepSearch.process_results_batch write them
+_BATCHED_RESULT = re.compile(r'<result index="\d+">\n<query>(.*?)</query>\n(.*?)\n</result>', re.S)
+_SINGLE_RESULT = re.compile(r"<query>(.*?)</query>.*?<result>(.*?)</result>", re.S)
+
+
+def _extraction_items(model_name: str, prompt: str) -> tuple:
+    """Keys of the (query, result) pairs of an extraction prompt and whether it is batched"""
+    pairs = _BATCHED_RESULT.findall(prompt)
+    batched = bool(pairs)
+    if not batched:
+        pairs = _SINGLE_RESULT.findall(prompt)[:1]
+    return [_record_key("item", model_name, f"{query}\0{result}") for query, result in pairs], batched
+
+
+class RecordingBackend:
+    """
+    Wraps another backend and appends every response to a JSONL file.
+    Learning extraction records also list the search results they cover,
+    so ReplayBackend can answer them however the results are batched.
+    """
+
+    def __init__(self, inner, path: str):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _write(self, kind: str, model_name: str, prompt: str, responses: list):
+        record = {
+            "key": _record_key(kind, model_name, prompt),
+            "kind": kind,
+            "model": model_name,
+            "responses": [{"text": r.text, "raw": r.raw} for r in responses],
+        }
+        items, _ = _extraction_items(model_name, prompt) if kind == "generate" else ([], False)
+        if items:
+            record["items"] = items
+        line = json.dumps(record, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def generate(self, prompt: str, generation_config: dict, model_name: str) -> LLMResponse:
+        response = self.inner.generate(prompt, generation_config, model_name)
+        self._write("generate", model_name, prompt, [response])
+        return response
+
+    def generate_grounded(self, prompt: str, generation_config: dict, model_name: str) -> LLMResponse:
+        response = self.inner.generate_grounded(prompt, generation_config, model_name)
+        self._write("grounded", model_name, prompt, [response])
+        return response
+
+    def generate_stream(self, prompt: str, generation_config: dict, model_name: str):
+        chunks = []
+        for chunk in self.inner.generate_stream(prompt, generation_config, model_name):
+            chunks.append(chunk)
+            yield chunk
+        self._write("stream", model_name, prompt, chunks)
+
+
+class ReplayBackend:
+    """
+    Serves responses captured by RecordingBackend, grounding metadata
+    included, without touching the network. Prompts that were recorded more
+    than once are answered in recording order, cycling when exhausted.
+
+    Which search results share a learning extraction batch depends on
+    timing, so an extraction prompt that was not recorded as such is
+    answered from the recorded answers for each of its results instead.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._records = {}
+        self._items = {}  # item key -> recorded extraction answers for that search result
+        self._cursor = {}
+        self._lock = threading.Lock()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._records.setdefault(record["key"], []).append(record["responses"])
+                    if record.get("items"):
+                        self._add_items(record["items"], record["responses"][0]["text"])
+
+    def _add_items(self, items: list, text: str):
+        try:
+            answer = json.loads(text)
+        except ValueError:
+            return
+        if "results" not in answer:
+            # A single result's answer
+            self._items.setdefault(items[0], []).append(answer)
+            return
+        # Results the model left out of its answer are replayed as left out (None)
+        entries = [None] * len(items)
+        for entry in answer["results"]:
+            index = entry.get("query_index", -1)
+            if isinstance(index, int) and 0 <= index < len(items):
+                entries[index] = {k: v for k, v in entry.items() if k != "query_index"}
+        for item, entry in zip(items, entries):
+            self._items.setdefault(item, []).append(entry)
+
+    def _take(self, recorded: dict, key: str):
+        # Callers hold self._lock
+        index = self._cursor.get(key, 0)
+        self._cursor[key] = index + 1
+        return recorded[key][index % len(recorded[key])]
+
+    def _next(self, kind: str, model_name: str, prompt: str) -> list:
+        key = _record_key(kind, model_name, prompt)
+        with self._lock:
+            if self._records.get(key):
+                return [LLMResponse(r["text"], r["raw"]) for r in self._take(self._records, key)]
+            items, batched = _extraction_items(model_name, prompt) if kind == "generate" else ([], False)
+            if items and all(item in self._items for item in items):
+                answers = [self._take(self._items, item) for item in items]
+                if batched:
+                    answers = {"results": [
+                        {"query_index": i, **answer} for i, answer in enumerate(answers) if answer is not None
+                    ]}
+                else:
+                    answers = answers[0] or {"learnings": [], "follow_up_questions": []}
+                return [LLMResponse(json.dumps(answers), {})]
+        raise LookupError(f"No recorded {kind} response for prompt: {prompt[:80]!r}")
+
+    def generate(self, prompt: str, generation_config: dict, model_name: str) -> LLMResponse:
+        return self._next("generate", model_name, prompt)[0]
+
+    def generate_grounded(self, prompt: str, generation_config: dict, model_name: str) -> LLMResponse:
+        return self._next("grounded", model_name, prompt)[0]
+
+    def generate_stream(self, prompt: str, generation_config: dict, model_name: str):
+        yield from self._next("stream", model_name, prompt)
+
+
+class SyntheticBackendError(ConnectionError):
+    """Transient failure injected by SyntheticBackend"""
+
+
+_WORDS = (
+    "adoption agents analysis automation benchmark capacity chips climate compute "
+    "costs data deployment economy efficiency energy ethics europe evaluation growth "
+    "healthcare hardware infrastructure investment jobs labor latency markets models "
+    "multimodal open policy productivity regulation research robotics safety scaling "
+    "security semiconductors startups supply training trust workforce"
+).split()
+
+
+class SyntheticBackend:
+    """
+    Stand-in backend with configurable latency and error rate.
+
+    Latencies are drawn from a log-normal distribution with the given median
+    and spread, and each call fails with probability `error_rate`. Structured
+    calls return JSON shaped after the request's response schema and
+    grounded calls come with plausible grounding metadata, so the whole
+    pipeline runs offline. Call counts and concurrency are tracked for
+    benchmarking.
+    """
+
+    def __init__(self, latency_median: float = 0.5, latency_sigma: float = 0.4, error_rate: float = 0.0,
+                 stream_chunks: int = 20, seed: int = None):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._serial = 0
+        self.calls = {"generate": 0, "grounded": 0, "stream": 0}
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.busy_seconds = 0.0
+
+    def _begin(self, kind: str) -> float:
+        with self._lock:
+            self.calls[kind] += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            latency = self._random.lognormvariate(0, self.latency_sigma) * self.latency_median
+            failed = self._random.random() < self.error_rate
+        if failed:
+            time.sleep(latency / 2)
+            self._end(latency / 2)
+            with self._lock:
+                self.errors += 1
+            raise SyntheticBackendError(f"Injected {kind} failure")
+        return latency
+
+    def _end(self, seconds: float):
+        with self._lock:
+            self.in_flight -= 1
+            self.busy_seconds += seconds
+
+    def _sentence(self, words: int = 12) -> str:
+        with self._lock:
+            self._serial += 1
+            serial = self._serial
+            picked = self._random.sample(_WORDS, words)
+        return f"Finding {serial}: " + " ".join(picked) + "."
+
+    def _value(self, schema, index: int = 0):
+        if schema.type_ == content.Type.OBJECT:
+            return {name: self._value(prop, index) for name, prop in schema.properties.items()}
+        if schema.type_ == content.Type.ARRAY:
+            return [self._value(schema.items, i) for i in range(3)]
+        if schema.type_ == content.Type.INTEGER:
+            # Position within the enclosing array, e.g. for batched results
+            return index
+        if schema.type_ == content.Type.NUMBER:
+            return 2
+        if schema.type_ == content.Type.BOOLEAN:
+            return False
+        return self._sentence(8)
+
+    @staticmethod
+    def _usage(prompt: str, text: str) -> dict:
+        prompt_tokens = max(1, len(prompt) // 4)
+        output_tokens = max(1, len(text) // 4)
+        return {
+            "prompt_token_count": prompt_tokens,
+            "candidates_token_count": output_tokens,
+            "total_token_count": prompt_tokens + output_tokens,
+        }
+
+    def generate(self, prompt: str, generation_config: dict, model_name: str) -> LLMResponse:
+        latency = self._begin("generate")
+        time.sleep(latency)
+        schema = generation_config.get("response_schema")
+        if schema is not None:
+            text = json.dumps(self._value(schema))
+        else:
+            text = " ".join(self._sentence() for _ in range(5))
+        self._end(latency)
+        return LLMResponse(text, {"usage_metadata": self._usage(prompt, text)})
+
+    def generate_grounded(self, prompt: str, generation_config: dict, model_name: str) -> LLMResponse:
+        latency = self._begin("grounded")
+        time.sleep(latency)
+        sentences = [self._sentence() for _ in range(4)]
+        text = " ".join(sentences)
+        chunks = []
+        supports = []
+        end = 0
+        for i, sentence in enumerate(sentences):
+            end += len(sentence.encode("utf-8")) + (1 if i else 0)
+            with self._lock:
+                serial = self._serial
+            chunks.append({"web": {"uri": f"https://example.com/{serial}/{i}", "title": f"Source {serial}.{i}"}})
+            supports.append({"segment": {"end_index": end}, "grounding_chunk_indices": [i]})
+        raw = {
+            "candidates": [{"grounding_metadata": {
+                "grounding_chunks": chunks,
+                "grounding_supports": supports,
+            }}],
+            "usage_metadata": self._usage(prompt, text),
+        }
+        self._end(latency)
+        return LLMResponse(text, raw)
+
+    def generate_stream(self, prompt: str, generation_config: dict, model_name: str):
+        latency = self._begin("stream")
+        total = 0.0
+        try:
+            for i in range(self.stream_chunks):
+                # The first chunk carries the time-to-first-token
+                delay = latency if i == 0 else latency / self.stream_chunks
+                time.sleep(delay)
+                total += delay
+                text = self._sentence() + " "
+                raw = {}
+                if i == self.stream_chunks - 1:
+                    raw = {"usage_metadata": self._usage(prompt, text * self.stream_chunks)}
+                yield LLMResponse(text, raw)
+        finally:
+            self._end(total)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "errors": self.errors,
+                "peak_in_flight": self.peak_in_flight,
+                "busy_seconds": self.busy_seconds,
+            }
+
+
+def create_backend(api_key: str):
+    """
+    Build the backend selected by GEMINI_BACKEND: "gemini" (default),
+    "record" (Gemini, saving responses to GEMINI_RECORD_PATH), "replay"
+    (serving GEMINI_RECORD_PATH offline) or "synthetic".
+    """
+    kind = os.getenv("GEMINI_BACKEND", "gemini")
+    record_path = os.getenv("GEMINI_RECORD_PATH", os.path.join(".cache", "gemini_recording.jsonl"))
+    if kind == "gemini":
+        return GeminiBackend(api_key)
+    if kind == "record":
+        return RecordingBackend(GeminiBackend(api_key), record_path)
+    if kind == "replay":
+        return ReplayBackend(record_path)
+    if kind == "synthetic":
+        return SyntheticBackend(
+            latency_median=float(os.getenv("SYNTHETIC_LATENCY", "0.5")),
+            error_rate=float(os.getenv("SYNTHETIC_ERROR_RATE", "0")),
+        )
+    raise ValueError(f"Unknown GEMINI_BACKEND: {kind}")
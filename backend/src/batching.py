@@ -0,0 +1,103 @@
+import asyncio
+
+from .scheduler import estimate_tokens
+
+
+class ExtractionBatcher:
+    """
+    Coalesces learning extraction for sibling queries into batched requests.
+
+    Each query announces itself with `expect` before it starts searching and
+    then hands its search result to `submit`. A batch is sent as soon as every
+    announced query has submitted, `batch_size` results are waiting, the next
+    result would push the batch past `token_budget` input tokens, or
+    `max_wait` seconds have passed since the first result arrived. A batch of
+    one falls back to the single-result call. Results are sent ordered by
+    query rather than by arrival, so a batch always makes the same request.
+    """
+
+    def __init__(self, process_single, process_batch, batch_size: int = 5,
+                 token_budget: int = 32000, max_wait: float = 2.0):
+        self.process_single = process_single
+        self.process_batch = process_batch
+        self.batch_size = batch_size
+        self.token_budget = token_budget
+        self.max_wait = max_wait
+        self.batches_sent = 0
+        self._expected = 0
+        self._pending = []  # (query, result, future)
+        self._pending_tokens = 0
+        self._timer = None
+        self._tasks = set()
+
+    def expect(self):
+        """Announce a query whose result will be submitted later"""
+        self._expected += 1
+
+    def withdraw(self):
+        """Cancel an announcement, e.g. because the search failed"""
+        self._expected -= 1
+        self._maybe_flush()
+
+    async def submit(self, query: str, result: str) -> dict:
+        """Queue a search result and wait for its extracted learnings"""
+        tokens = estimate_tokens(result)
+        if self._pending and self._pending_tokens + tokens > self.token_budget:
+            # Keep each request inside the budget by sending what is waiting first
+            self._flush()
+
+        future = asyncio.get_running_loop().create_future()
+        self._expected -= 1
+        self._pending.append((query, result, future))
+        self._pending_tokens += tokens
+
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        self._maybe_flush()
+        return await future
+
+    async def cancel(self):
+        """Drop waiting results and cancel the batches in flight, e.g. because their run was cancelled"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending, self._pending_tokens = [], 0
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _maybe_flush(self):
+        if self._pending and (len(self._pending) >= self.batch_size or self._expected <= 0):
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch = sorted(self._pending, key=lambda item: (item[0], item[1]))
+        self._pending, self._pending_tokens = [], 0
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        self.batches_sent += 1
+        try:
+            if len(batch) == 1:
+                query, result, _ = batch[0]
+                answers = [await self.process_single(query, result)]
+            else:
+                answers = await self.process_batch([(query, result) for query, result, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), answer in zip(batch, answers):
+            if not future.done():
+                future.set_result(answer)
@@ -0,0 +1,106 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class CheckpointStore:
+    """
+    SQLite store of per-run research checkpoints.
+
+    A run records its parameters once and then one row per finished step
+    (the generated query plan, each node's search result and each node's
+    processed learnings), written as soon as the step completes. Resuming a
+    run loads those rows and only re-issues the steps that are missing.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                run_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (run_id, key)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def save_run(self, run_id: str, params: dict):
+        """Record the parameters of a run, keeping the original ones on resume"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO runs VALUES (?, ?, ?)",
+                (run_id, json.dumps(params), time.time()),
+            )
+            self._conn.commit()
+
+    def get_run(self, run_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT params FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, run_id: str, key: str, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                (run_id, key, json.dumps(value), time.time()),
+            )
+            self._conn.commit()
+
+    def load(self, run_id: str) -> dict:
+        """Return every checkpoint of a run as a key -> value dict"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM checkpoints WHERE run_id = ?", (run_id,)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Delete runs, and their checkpoints, older than `max_age_seconds`"""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM checkpoints WHERE run_id IN (SELECT run_id FROM runs WHERE created_at < ?)",
+                (cutoff,),
+            )
+            cursor = self._conn.execute("DELETE FROM runs WHERE created_at < ?", (cutoff,))
+            self._conn.commit()
+        return cursor.rowcount
+
+
+_checkpoint_store = None
+_checkpoint_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """Return the process-wide checkpoint store, dropping runs past CHECKPOINT_TTL"""
+    global _checkpoint_store
+    with _checkpoint_store_lock:
+        if _checkpoint_store is None:
+            _checkpoint_store = CheckpointStore(
+                os.getenv("CHECKPOINT_PATH", os.path.join(".cache", "checkpoints.sqlite3"))
+            )
+            _checkpoint_store.prune(float(os.getenv("CHECKPOINT_TTL", str(7 * 24 * 3600))))
+        return _checkpoint_store
@@ -0,0 +1,187 @@
+import html
+
+
+FORMATS = ("markdown", "html", "json")
+
+
+def _grounding_metadata(response_dict: dict) -> dict:
+    candidates = (response_dict or {}).get("candidates") or []
+    if not candidates:
+        return {}
+    return candidates[0].get("grounding_metadata") or {}
+
+
+def parse_grounding(response_dict: dict, registry=None, numbers: dict = None) -> tuple:
+    """
+    Read the grounding metadata of a response.
+
+    Returns (sources, supports): `sources` maps citation numbers to
+    {"link", "title"} dicts and `supports` lists (start, end, numbers)
+    tuples with UTF-8 byte offsets into the response text, one per support
+    and with every chunk it cites. Citation numbers are grounding chunk
+    index + 1, or source ids when a SourceRegistry is given. `numbers`
+    collects the chunk index -> citation number mapping across calls.
+    """
+    metadata = _grounding_metadata(response_dict)
+    numbers = {} if numbers is None else numbers
+    sources = {}
+    for i, chunk in enumerate(metadata.get("grounding_chunks") or []):
+        web = chunk.get("web")
+        if not web:
+            continue
+        source = {"link": web.get("uri", ""), "title": web.get("title", "")}
+        numbers[i] = registry.add(source["link"], source["title"]) if registry is not None else i + 1
+        sources[numbers[i]] = source
+
+    supports = []
+    for support in metadata.get("grounding_supports") or []:
+        segment = support.get("segment") or {}
+        if segment.get("end_index") is None:
+            continue
+        cited = []
+        for index in support.get("grounding_chunk_indices") or []:
+            number = numbers.get(index)
+            if number is not None and number not in cited:
+                cited.append(number)
+        if cited:
+            supports.append((segment.get("start_index") or 0, segment["end_index"], cited))
+    return sources, supports
+
+
+def _char_boundary(data: bytes, offset: int) -> int:
+    """Move a byte offset forward to the next UTF-8 character boundary"""
+    offset = min(max(offset, 0), len(data))
+    while offset < len(data) and data[offset] & 0xC0 == 0x80:
+        offset += 1
+    return offset
+
+
+def _marker(numbers: list, sources: dict, fmt: str) -> str:
+    if fmt == "html":
+        return "".join(
+            f'<sup class="citation"><a href="{html.escape(sources[number]["link"], quote=True)}">[{number}]</a></sup>'
+            for number in numbers
+        )
+    return "".join(f"[[{number}]]({sources[number]['link']})" for number in numbers)
+
+
+class CitationRenderer:
+    """
+    Splices citations into text at the UTF-8 byte offsets Gemini reports.
+
+    Supports are ordered by end offset once and then spliced in a single
+    pass over the encoded text, with the output assembled by a join. Several
+    supports ending at the same offset, and several chunks per support, all
+    get their citation. Formats are "markdown" ([[n]](link) after the span),
+    "html" (escaped text with <sup> links) and "json" (the list of cited
+    spans with character offsets and their sources).
+    """
+
+    def __init__(self, fmt: str = "markdown"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown citation format: {fmt}")
+        self.fmt = fmt
+
+    def render(self, text: str, supports: list, sources: dict):
+        data = text.encode("utf-8")
+        if self.fmt == "json":
+            return self._spans(data, supports, sources)
+
+        escape = html.escape if self.fmt == "html" else str
+        pieces = []
+        position = 0
+        pending = []  # Numbers cited at the current position
+        for _, end, numbers in sorted(supports, key=lambda support: support[1]):
+            end = max(_char_boundary(data, end), position)
+            if end != position:
+                if pending:
+                    pieces.append(_marker(pending, sources, self.fmt))
+                    pending = []
+                pieces.append(escape(data[position:end].decode("utf-8")))
+                position = end
+            pending.extend(number for number in numbers if number not in pending)
+        if pending:
+            pieces.append(_marker(pending, sources, self.fmt))
+        pieces.append(escape(data[position:].decode("utf-8")))
+        return "".join(pieces)
+
+    def _spans(self, data: bytes, supports: list, sources: dict) -> list:
+        # Translate byte offsets to character offsets in one sweep over the
+        # sorted distinct offsets
+        offsets = sorted({_char_boundary(data, offset) for start, end, _ in supports for offset in (start, end)})
+        chars = {}
+        byte_position = 0
+        char_position = 0
+        for offset in offsets:
+            char_position += len(data[byte_position:offset].decode("utf-8"))
+            byte_position = offset
+            chars[offset] = char_position
+
+        spans = []
+        for start, end, numbers in sorted(supports, key=lambda support: (support[0], support[1])):
+            start = _char_boundary(data, start)
+            end = _char_boundary(data, end)
+            spans.append({
+                "start": chars[start],
+                "end": chars[end],
+                "text": data[start:end].decode("utf-8"),
+                "sources": [{"id": number, **sources[number]} for number in numbers],
+            })
+        return spans
+
+
+def render_citations(text: str, response_dict: dict, registry=None, fmt: str = "markdown"):
+    """Render `text` with the citations from the grounding metadata of `response_dict`"""
+    sources, supports = parse_grounding(response_dict, registry)
+    return CitationRenderer(fmt).render(text, supports, sources), sources
+
+
+class StreamingCitationFormatter:
+    """
+    Splices grounding citations into a report while it is being streamed.
+
+    Text is released one chunk behind the model, because the grounding
+    supports for a span can arrive with the chunk that follows it. Streamed
+    text is kept as UTF-8 bytes, since that is what the support offsets
+    count. Citations that arrive for text which has already been released
+    are appended at the current position so they are never lost. With a
+    SourceRegistry, citations are numbered by the run's source ids.
+    """
+
+    def __init__(self, registry=None, fmt: str = "markdown"):
+        if fmt not in ("markdown", "html"):
+            raise ValueError(f"Unsupported streaming citation format: {fmt}")
+        self.registry = registry
+        self.numbers = {}  # Grounding chunk index -> citation number
+        self.sources = {}
+        self._renderer = CitationRenderer(fmt)
+        self._data = bytearray()
+        self._released = 0  # Bytes of raw text handed out so far
+        self._held = 0  # Raw text length at the previous feed
+        self._supports = []  # Supports not yet released
+
+    def _collect(self, response_dict: dict):
+        sources, supports = parse_grounding(response_dict, self.registry, self.numbers)
+        self.sources.update(sources)
+        self._supports.extend(supports)
+
+    def _release(self, upto: int) -> str:
+        ready = [support for support in self._supports if support[1] <= upto]
+        self._supports = [support for support in self._supports if support[1] > upto]
+        # Offsets relative to the released window; late supports land at its start
+        window = [(0, max(end - self._released, 0), numbers) for _, end, numbers in ready]
+        text = bytes(self._data[self._released:upto]).decode("utf-8")
+        self._released = upto
+        return self._renderer.render(text, window, self.sources)
+
+    def feed(self, text: str, response_dict: dict = None) -> str:
+        """Add a streamed chunk and return the text that is ready to show"""
+        self._data += text.encode("utf-8")
+        self._collect(response_dict)
+        ready = self._release(self._held)
+        self._held = len(self._data)
+        return ready
+
+    def finish(self) -> str:
+        """Return everything that is still held back"""
+        return self._release(len(self._data))
@@ -0,0 +1,122 @@
+import importlib
+import json
+import os
+import threading
+
+
+class _LazyModule:
+    """Module proxy that imports the real module on first attribute access"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# The Google SDKs take over a second to import, so they are only loaded once
+# a model call, or a response schema, actually needs them
+content = _LazyModule("google.ai.generativelanguage_v1beta.types.content")
+
+
+def _reuse_connections(client, max_connections: int):
+    """
+    google-genai 0.1.0 opens a new requests.Session, and so a new TLS
+    connection, for every call. Route its unauthenticated requests through
+    one pooled keep-alive session instead. Other SDK versions are left alone.
+    """
+    api_client = getattr(client, "_api_client", None)
+    if api_client is None or not hasattr(api_client, "_request_unauthorized"):
+        return
+
+    import requests
+    from google.genai import _api_client as sdk
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+    session.mount("https://", adapter)
+
+    def request_unauthorized(http_request, stream: bool = False):
+        data = http_request.data
+        if data and not isinstance(data, bytes):
+            data = json.dumps(data, cls=sdk.RequestJsonEncoder)
+        prepared = requests.Request(
+            method=http_request.method,
+            url=http_request.url,
+            headers=http_request.headers,
+            data=data or None,
+        ).prepare()
+        response = session.send(prepared, stream=stream)
+        sdk.errors.APIError.raise_for_response(response)
+        return sdk.HttpResponse(response.headers, response if stream else [response.text])
+
+    if hasattr(sdk, "HttpResponse") and hasattr(sdk, "RequestJsonEncoder"):
+        api_client._request_unauthorized = request_unauthorized
+
+
+class ClientPool:
+    """
+    Process-wide Gemini SDK clients and model handles.
+
+    google-generativeai is configured once per API key (configuring it again
+    drops its cached gRPC channels), model handles are kept per model name
+    and the google-genai client used for grounded search shares one
+    keep-alive HTTP session. Generation settings are passed per call, so
+    every request can reuse the same handles.
+    """
+
+    def __init__(self, max_connections: int = 32):
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self._configured_key = None
+        self._models = {}
+        self._clients = {}
+
+    def model(self, api_key: str, model_name: str):
+        with self._lock:
+            key = (api_key, model_name)
+            model = self._models.get(key)
+            if model is None:
+                import google.generativeai as genai
+
+                if self._configured_key != api_key:
+                    genai.configure(api_key=api_key)
+                    self._configured_key = api_key
+                model = genai.GenerativeModel(model_name)
+                self._models[key] = model
+            return model
+
+    def client(self, api_key: str):
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                from google import genai as genai_client
+
+                client = genai_client.Client(api_key=api_key)
+                _reuse_connections(client, self.max_connections)
+                self._clients[api_key] = client
+            return client
+
+    def warm_up(self, api_key: str, model_names: tuple = ("gemini-2.0-flash",)):
+        """Import the SDKs and create the clients ahead of the first request"""
+        for model_name in model_names:
+            self.model(api_key, model_name)
+        self.client(api_key)
+        # Response schemas are built from these types
+        content.Schema
+
+
+_client_pool = None
+_client_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """Return the process-wide client pool, sized like the model call executor"""
+    global _client_pool
+    with _client_pool_lock:
+        if _client_pool is None:
+            _client_pool = ClientPool(int(os.getenv("GEMINI_MAX_WORKERS", "32")))
+        return _client_pool
@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import json
+import time
+
+from .metrics import COALESCED_REQUESTS
+from .search_cache import normalize_query
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return normalize_query(value)
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def fingerprint(payload: dict) -> str:
+    """Hash a request payload with its strings normalized like search queries"""
+    encoded = json.dumps(_normalize(payload), sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls onto one in-flight computation.
+
+    The first caller for a key starts the computation as a task; callers
+    arriving while it runs wait for the same task and receive the same result
+    or exception. Successful results are kept for `reuse_window` seconds
+    after completion. If every waiting caller goes away, the computation is
+    cancelled. Meant to be used from a single event loop, like the API's.
+    """
+
+    def __init__(self, name: str, reuse_window: float = 10.0):
+        self.name = name
+        self.reuse_window = reuse_window
+        self._flights = {}  # key -> [task, waiters]
+        self._recent = {}  # key -> (expires_at, result)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        self._flights.pop(key, None)
+        if self.reuse_window <= 0 or task.cancelled() or task.exception() is not None:
+            return
+        now = time.monotonic()
+        # Drop expired results so the table only holds the current window
+        for stale in [k for k, (expires_at, _) in self._recent.items() if expires_at <= now]:
+            del self._recent[stale]
+        self._recent[key] = (now + self.reuse_window, task.result())
+
+    async def run(self, key: str, func):
+        """Return the result of `func()`, sharing it with identical calls for `key`"""
+        recent = self._recent.get(key)
+        if recent is not None and recent[0] > time.monotonic():
+            COALESCED_REQUESTS.labels(self.name, "reused").inc()
+            return recent[1]
+
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(func())
+            flight = self._flights[key] = [task, 0]
+            task.add_done_callback(lambda done: self._finish(key, done))
+            COALESCED_REQUESTS.labels(self.name, "leader").inc()
+        else:
+            COALESCED_REQUESTS.labels(self.name, "coalesced").inc()
+
+        flight[1] += 1
+        try:
+            return await asyncio.shield(flight[0])
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not flight[0].done():
+                flight[0].cancel()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "in_flight": len(self._flights),
+            "waiters": sum(waiters for _, waiters in self._flights.values()),
+            "reusable": sum(1 for expires_at, _ in self._recent.values() if expires_at > now),
+        }
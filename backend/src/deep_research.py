@@ -1,172 +1,327 @@
-from typing import Callable, List, TypeVar, Any
 import asyncio
 import datetime
+import hashlib
 import json
-import os
+import re
+import time
 import uuid
 
 import math
 
 from dotenv import load_dotenv
-from google.genai import types
 
-import google.generativeai as genai
+from .artifacts import get_artifact_store
+from .checkpoint import get_checkpoint_store
+from .batching import ExtractionBatcher
+from .citations import StreamingCitationFormatter, render_citations
+from .clients import content
+from .llm import LLMClient
+from .metrics import observe_phase
+from .scheduler import Priority, estimate_tokens
+from .search_cache import get_search_cache
+from .semantic_cache import get_semantic_cache
+from .sources import SourceRegistry, link_citations, split_partial_citation
+from .text_similarity import SimilarityIndex, consolidate, match_texts
+from .usage import RunLedger, current_node
+
+
+# A query combined with the user's follow-up answers, as built by the API and the CLI
+_FOLLOW_UPS = re.compile(r"\s*Initial query:\s*(.*?)\s*Follow up questions and answers:\s*(.*)", re.S)
+
+# Tokens kept free for the final report when a run has a token limit
+REPORT_TOKEN_RESERVE = 8192
+# Calls a node can need at most: its search and an extraction that could
+# not be batched with other nodes
+MAX_CALLS_PER_NODE = 2
+# Share of a run's deadline kept free for the final report, unless the
+# slowest model call so far needs more
+DEADLINE_REPORT_SHARE = 0.25
+
+# Reports over at least this many learnings are synthesized section by section
+MAP_REDUCE_MIN_LEARNINGS = 30
+# Subtrees whose learnings fit in this many tokens are drafted in one call
+SECTION_TOKEN_BUDGET = 6000
+# Characters of each section shown to the final merge
+MERGE_SECTION_CHARS = 4000
+
+# Queries of a run's first level reuse a prefetched search on a query at least this similar
+PREFETCH_SIMILARITY_THRESHOLD = 0.6
+
+
+class _QueryNode:
+    """A single query in the research tree"""
+
+    __slots__ = ("id", "query", "depth", "parent_id", "children",
+                 "learnings", "learning_set", "pending_children", "completed", "cancelled", "failed")
+
+    def __init__(self, node_id: int, query: str, depth: int, parent_id: int = None):
+        self.id = node_id
+        self.query = query
+        self.depth = depth
+        self.parent_id = parent_id
+        self.children = []
+        self.learnings = []
+        self.learning_set = set()
+        self.pending_children = 0
+        self.completed = False
+        self.cancelled = False
+        self.failed = False
 
-from google import genai as genai_client
 
-from google.ai.generativelanguage_v1beta.types import content
+class ResearchProgress:
+    """
+    Tracks the research tree and reports progress as it changes.
 
+    Nodes are addressed by integer ids with parent->children links, so every
+    update is O(1). Each change is published as a small delta event to the
+    registered listeners, and the stdout summary is rate-limited to one line
+    every `report_interval` seconds.
+    """
 
-class ResearchProgress:
-    def __init__(self, depth: int, breadth: int):
+    def __init__(self, depth: int, breadth: int, report_interval: float = 1.0):
         self.total_depth = depth
         self.total_breadth = breadth
         self.current_depth = depth
         self.current_breadth = 0
-        self.queries_by_depth = {}
-        self.query_order = []  # Track order of queries
-        self.query_parents = {}  # Track parent-child relationships
         self.total_queries = 0  # Total number of queries including sub-queries
         self.completed_queries = 0
-        self.query_ids = {}  # Store persistent IDs for queries
+        self.nodes = []  # Node records indexed by node id
+        self.node_ids = {}  # (depth, query) -> node id
+        self.latest_ids = {}  # query -> id of the latest node for it, used to resolve parents
+        self.breadth_by_depth = {}  # depth -> number of queries started at that depth
+        self.root_id = None
         self.root_query = None  # Store the root query
+        self.listeners = []  # Callables receiving every progress event
+        self.pruned = []  # Queries dropped to stay within the run's limits
+        self.report_interval = report_interval
+        self._last_report = 0.0
+        self._unreported_events = 0
+
+    def add_listener(self, listener):
+        """Register a callable that receives every progress event as a dict"""
+        self.listeners.append(listener)
+
+    def _node(self, query: str, depth: int):
+        node_id = self.node_ids.get((depth, query))
+        return None if node_id is None else self.nodes[node_id]
 
     def start_query(self, query: str, depth: int, parent_query: str = None):
         """Record the start of a new query"""
-        if depth not in self.queries_by_depth:
-            self.queries_by_depth[depth] = {}
-
-        if query not in self.queries_by_depth[depth]:
-            # Generate ID only once per query
-            if query not in self.query_ids:
-                self.query_ids[query] = str(uuid.uuid4())
-                
-            self.queries_by_depth[depth][query] = {
-                "completed": False,
-                "learnings": [],
-                "id": self.query_ids[query]  # Use persistent ID
-            }
-            self.query_order.append(query)
-            if parent_query:
-                self.query_parents[query] = parent_query
-            else:
-                self.root_query = query  # Set as root if no parent
-            self.total_queries += 1
-
+        self._register(query, depth, parent_query)
         self.current_depth = depth
-        self.current_breadth = len(self.queries_by_depth[depth])
+        self.current_breadth = self.breadth_by_depth[depth]
         self._report_progress(f"Starting query: {query}")
 
+    def _register(self, query: str, depth: int, parent_query: str = None) -> _QueryNode:
+        node = self._node(query, depth)
+        if node is None:
+            parent_id = self.latest_ids.get(parent_query) if parent_query else None
+            node = _QueryNode(len(self.nodes), query, depth, parent_id)
+            self.nodes.append(node)
+            self.node_ids[(depth, query)] = node.id
+            self.latest_ids[query] = node.id
+            self.breadth_by_depth[depth] = self.breadth_by_depth.get(depth, 0) + 1
+            if parent_id is not None:
+                parent = self.nodes[parent_id]
+                parent.children.append(node.id)
+                parent.pending_children += 1
+            else:
+                self.root_id = node.id  # Set as root if no parent
+                self.root_query = query
+            self.total_queries += 1
+            self._emit("query_started", node)
+        return node
+
     def add_learning(self, query: str, depth: int, learning: str):
         """Record a learning for a specific query"""
-        if depth in self.queries_by_depth and query in self.queries_by_depth[depth]:
-            if learning not in self.queries_by_depth[depth][query]["learnings"]:
-                self.queries_by_depth[depth][query]["learnings"].append(learning)
-                self._report_progress(f"Added learning for query: {query}")
+        node = self._node(query, depth)
+        if node is not None and learning not in node.learning_set:
+            node.learning_set.add(learning)
+            node.learnings.append(learning)
+            self._emit("learning_added", node, learning=learning)
+            self._report_progress(f"Added learning for query: {query}")
 
     def complete_query(self, query: str, depth: int):
         """Mark a query as completed"""
-        if depth in self.queries_by_depth and query in self.queries_by_depth[depth]:
-            if not self.queries_by_depth[depth][query]["completed"]:
-                self.queries_by_depth[depth][query]["completed"] = True
-                self.completed_queries += 1
-                self._report_progress(f"Completed query: {query}")
-
-                # Check if parent query exists and update its status if all children are complete
-                parent_query = self.query_parents.get(query)
-                if parent_query:
-                    self._update_parent_status(parent_query)
-
-    def _update_parent_status(self, parent_query: str):
-        """Update parent query status based on children completion"""
-        # Find all children of this parent
-        children = [q for q, p in self.query_parents.items() if p == parent_query]
-        
-        # Check if all children are complete
-        parent_depth = next((d for d, queries in self.queries_by_depth.items() 
-                           if parent_query in queries), None)
-        
-        if parent_depth is not None:
-            all_children_complete = all(
-                self.queries_by_depth[d][q]["completed"]
-                for q in children
-                for d in self.queries_by_depth
-                if q in self.queries_by_depth[d]
-            )
-            
-            if all_children_complete:
-                # Complete the parent query
-                self.complete_query(parent_query, parent_depth)
-
-    def _report_progress(self, action: str):
-        """Report current progress"""
-        print(f"\nResearch Progress Update:")
-        print(f"Action: {action}")
-
-        # Build and print the tree starting from the root query
-        if self.root_query:
-            tree = self._build_research_tree()
-            print("\nQuery Tree Structure:")
-            print(json.dumps(tree, indent=2))
-
-        print(f"\nOverall Progress: {self.completed_queries}/{self.total_queries} queries completed")
-        print("")
+        node = self._node(query, depth)
+        if node is not None:
+            self._complete(node)
+
+    def cancel_query(self, query: str, depth: int, parent_query: str = None):
+        """Mark a query as cancelled before it finished, e.g. by a deadline"""
+        # A query cancelled while waiting for its turn was never started
+        node = self._register(query, depth, parent_query)
+        if not node.completed:
+            node.cancelled = True
+            self._complete(node)
+
+    def fail_query(self, query: str, depth: int):
+        """Mark a query whose search or extraction failed; it still completes as usual"""
+        node = self._node(query, depth)
+        if node is not None:
+            node.failed = True
+
+    def prune_queries(self, queries: list):
+        """Record follow-up queries that were dropped without being started"""
+        self.pruned.extend(queries)
+
+    def _complete(self, node: _QueryNode):
+        while node is not None and not node.completed:
+            node.completed = True
+            self.completed_queries += 1
+            self._emit("query_cancelled" if node.cancelled else "query_completed", node)
+            self._report_progress(f"Completed query: {node.query}", force=node.id == self.root_id)
+
+            # Complete the parent as well once all of its children are done
+            if node.parent_id is None:
+                break
+            parent = self.nodes[node.parent_id]
+            parent.pending_children -= 1
+            node = parent if parent.pending_children == 0 else None
+
+    def _emit(self, event_type: str, node: _QueryNode, **data):
+        self._unreported_events += 1
+        if not self.listeners:
+            return
+        event = {
+            "type": event_type,
+            "node_id": node.id,
+            "parent_id": node.parent_id,
+            "depth": node.depth,
+            "query": node.query,
+            "completed_queries": self.completed_queries,
+            "total_queries": self.total_queries,
+            **data,
+        }
+        for listener in self.listeners:
+            listener(event)
+
+    def _report_progress(self, action: str, force: bool = False):
+        """Print a progress summary, at most once per report interval"""
+        now = time.monotonic()
+        if not force and now - self._last_report < self.report_interval:
+            return
+        print(
+            f"Research progress: {self.completed_queries}/{self.total_queries} queries completed "
+            f"({self._unreported_events} updates) - {action}"
+        )
+        self._last_report = now
+        self._unreported_events = 0
 
     def _build_research_tree(self):
         """Build the full research tree structure"""
-        def build_node(query):
+        def build_node(node: _QueryNode):
             """Recursively build the tree node"""
-            # Find the depth for this query
-            depth = next((d for d, queries in self.queries_by_depth.items() 
-                         if query in queries), 0)
-            
-            data = self.queries_by_depth[depth][query]
-            
-            # Find all children of this query
-            children = [q for q, p in self.query_parents.items() if p == query]
-            
+            parent = self.nodes[node.parent_id] if node.parent_id is not None else None
             return {
-                "query": query,
-                "id": self.query_ids[query],
-                "status": "completed" if data["completed"] else "in_progress",
-                "depth": depth,
-                "learnings": data["learnings"],
-                "sub_queries": [build_node(child) for child in children],
-                "parent_query": self.query_parents.get(query)
+                "query": node.query,
+                "id": node.id,
+                "status": "cancelled" if node.cancelled else "failed" if node.failed
+                          else "completed" if node.completed else "in_progress",
+                "depth": node.depth,
+                "learnings": list(node.learnings),
+                "sub_queries": [build_node(self.nodes[child]) for child in node.children],
+                "parent_query": parent.query if parent else None
             }
 
         # Start building from the root query
-        if self.root_query:
-            return build_node(self.root_query)
+        if self.root_id is not None:
+            return build_node(self.nodes[self.root_id])
         return {}
 
+    def coverage(self) -> dict:
+        """Which queries below the root finished, failed, were cancelled or were never started"""
+        nodes = [node for node in self.nodes if node.id != self.root_id]
+        return {
+            "finished": [node.query for node in nodes if node.completed and not node.cancelled and not node.failed],
+            "failed": [node.query for node in nodes if node.failed and not node.cancelled],
+            "cancelled": [node.query for node in nodes if node.cancelled],
+            "pruned": list(self.pruned),
+            "total": len(nodes) + len(self.pruned),
+        }
+
     def get_learnings_by_query(self):
         """Get all learnings organized by query"""
         learnings = {}
-        for depth, queries in self.queries_by_depth.items():
-            for query, data in queries.items():
-                if data["learnings"]:
-                    learnings[query] = data["learnings"]
+        for node in self.nodes:
+            if node.learnings:
+                learnings[node.query] = node.learnings
         return learnings
 
 
 load_dotenv()
 
 class DeepSearch:
-    def __init__(self, api_key: str, mode: str = "balanced"):
+    def __init__(self, api_key: str, mode: str = "balanced", query_similarity_threshold: float = 0.8, backend=None,
+                 learning_similarity_threshold: float = 0.75,
+                 extraction_batch_size: int = 5, extraction_token_budget: int = 32000,
+                 max_concurrency: int = 8, max_nodes: int = 40,
+                 max_calls: int = None, max_tokens: int = None, max_seconds: float = None,
+                 report_synthesis: str = "auto"):
         """
         Initialize DeepSearch with a mode parameter:
         - "fast": Prioritizes speed (reduced breadth/depth, highest concurrency)
         - "balanced": Default balance of speed and comprehensiveness
         - "comprehensive": Maximum detail and coverage
+
+        Generated queries whose similarity to an earlier query reaches
+        `query_similarity_threshold` are dropped before they are searched.
+        Learnings from different branches reaching
+        `learning_similarity_threshold` are merged before the report.
+        `backend` overrides the model backend chosen by GEMINI_BACKEND, e.g.
+        with a ReplayBackend or SyntheticBackend for offline runs.
+
+        Learning extraction for sibling queries is batched into requests of
+        up to `extraction_batch_size` results and `extraction_token_budget`
+        input tokens; a batch size of 1 sends one request per query.
+
+        Comprehensive runs expand the research tree one level at a time, with
+        at most `max_concurrency` queries in flight and `max_nodes` queries
+        researched in total.
+
+        Every model call is recorded in `self.usage`, a RunLedger. When
+        `max_calls`, `max_tokens` or `max_seconds` is set, deep_research stops
+        expanding the tree before the limit is reached, keeping enough room
+        for the final report.
+
+        `report_synthesis` picks how the final report is written: "single"
+        sends every learning in one prompt, "map_reduce" drafts a section per
+        research subtree concurrently and merges them, and "auto" uses
+        map-reduce for runs with many learnings.
         """
         self.api_key = api_key
         self.model_name = "gemini-2.0-flash"
         self.query_history = set()
+        self.query_index = SimilarityIndex(threshold=query_similarity_threshold)
+        self.learning_similarity_threshold = learning_similarity_threshold
         self.mode = mode
-        genai.configure(api_key=self.api_key)
+        self.extraction_batch_size = extraction_batch_size
+        self.extraction_token_budget = extraction_token_budget
+        self.max_concurrency = max_concurrency
+        self.max_nodes = max_nodes
+        self.report_synthesis = report_synthesis
+        self.usage = RunLedger(max_calls=max_calls, max_tokens=max_tokens, max_seconds=max_seconds)
+        self.llm = LLMClient(self.api_key, backend, ledger=self.usage)
+        self.search_cache = get_search_cache()
+        self.planning_cache = get_semantic_cache()
+        self.checkpoints = get_checkpoint_store()
+        self.artifacts = get_artifact_store()
+        self.listeners = []  # Callables receiving research events as dicts
+
+    def add_listener(self, listener):
+        """Register a callable that receives progress and source events"""
+        self.listeners.append(listener)
+
+    def _emit(self, event: dict):
+        for listener in self.listeners:
+            listener(event)
+
+    @observe_phase("determine_research_breadth_and_depth")
+    async def determine_research_breadth_and_depth(self, query: str):
+        cached = self.planning_cache.get("breadth_and_depth", query)
+        if cached is not None:
+            return cached
 
-    def determine_research_breadth_and_depth(self, query: str):
         user_prompt = f"""
 		You are a research planning assistant. Your task is to determine the appropriate breadth and depth for researching a topic defined by a user's query. Evaluate the query's complexity and scope, then recommend values on the following scales:
 
@@ -210,21 +365,27 @@ class DeepSearch:
             ),
         }
 
-        model = genai.GenerativeModel(
-            "gemini-2.0-flash",
-            generation_config=generation_config,
-        )
-
-        response = model.generate_content(user_prompt)
+        response = await self.llm.generate(
+            user_prompt, generation_config, priority=Priority.INTERACTIVE,
+            phase="determine_research_breadth_and_depth")
         answer = response.text
 
-        return json.loads(answer)
+        answer_json = json.loads(answer)
+        self.planning_cache.put("breadth_and_depth", query, answer_json)
+
+        return answer_json
 
-    def generate_follow_up_questions(
+    @observe_phase("generate_follow_up_questions")
+    async def generate_follow_up_questions(
         self,
         query: str,
         max_questions: int = 3,
     ):
+        cache_namespace = f"follow_up_questions:{max_questions}"
+        cached = self.planning_cache.get(cache_namespace, query)
+        if cached is not None:
+            return cached
+
         user_prompt = f"""
 		Given the following query from the user, ask some follow up questions to clarify the research direction.
 
@@ -252,23 +413,34 @@ class DeepSearch:
             ),
         }
 
-        model = genai.GenerativeModel(
-            "gemini-2.0-flash",
-            generation_config=generation_config,
-        )
-
-        response = model.generate_content(user_prompt)
+        response = await self.llm.generate(
+            user_prompt, generation_config, priority=Priority.INTERACTIVE,
+            phase="generate_follow_up_questions")
         answer = response.text
 
-        return json.loads(answer)["follow_up_queries"]
+        questions = json.loads(answer)["follow_up_queries"]
+        self.planning_cache.put(cache_namespace, query, questions)
 
-    def generate_queries(
+        return questions
+
+    @observe_phase("generate_queries")
+    async def generate_queries(
             self,
             query: str,
             num_queries: int = 3,
             learnings: list[str] = [],
-            previous_queries: set[str] = None  # Add previous_queries parameter
+            previous_queries: list[str] = None  # Add previous_queries parameter
     ):
+        # Only the initial question is matched approximately; a plan is never
+        # shared between different follow-up answers or learnings
+        cache_namespace = f"queries:{num_queries}"
+        combined = _FOLLOW_UPS.fullmatch(query)
+        cache_text, answers = combined.groups() if combined else (query, "")
+        cache_context = "\n".join([answers, *learnings])
+        cached = self.planning_cache.get(cache_namespace, cache_text, cache_context)
+        if cached is not None:
+            return cached
+
         now = datetime.datetime.now().strftime("%Y-%m-%d")
 
         # Format previous queries for the prompt
@@ -312,97 +484,41 @@ class DeepSearch:
             "response_mime_type": "application/json",
         }
 
-        model = genai.GenerativeModel(
-            "gemini-2.0-flash",
-            generation_config=generation_config,
-        )
-
         # generate a list of queries
-        response = model.generate_content(
-            user_prompt + learnings_prompt
+        response = await self.llm.generate(
+            user_prompt + learnings_prompt,
+            generation_config,
+            phase="generate_queries"
         )
 
         answer = response.text
 
         answer_list = json.loads(answer)["queries"]
+        self.planning_cache.put(cache_namespace, cache_text, answer_list, cache_context)
 
         return answer_list
 
-    def format_text_with_sources(self, response_dict: dict, answer: str):
+    def format_text_with_sources(self, response_dict: dict, answer: str, registry: SourceRegistry = None,
+                                 fmt: str = "markdown"):
         """
         Format text with sources from Gemini response, adding citations at specified positions.
-        Returns tuple of (formatted_text, sources_dict).
+        Returns tuple of (formatted_text, sources_dict). Citations are numbered by
+        grounding chunk, or by source id when a SourceRegistry is given; `fmt` is
+        "markdown", "html" or "json" (a list of cited spans instead of text).
         """
-        if not response_dict or not response_dict.get('candidates'):
-            return answer, {}
-
-        # Get grounding metadata from the response
-        grounding_metadata = response_dict['candidates'][0].get(
-            'grounding_metadata')
-        if not grounding_metadata:
-            return answer, {}
-
-        # Get grounding chunks and supports
-        grounding_chunks = grounding_metadata.get('grounding_chunks', [])
-        grounding_supports = grounding_metadata.get('grounding_supports', [])
-
-        if not grounding_chunks or not grounding_supports:
-            return answer, {}
-
         try:
-            # Create mapping of URLs
-            sources = {
-                i: {
-                    'link': chunk.get('web', {}).get('uri', ''),
-                    'title': chunk.get('web', {}).get('title', '')
-                }
-                for i, chunk in enumerate(grounding_chunks)
-                if chunk.get('web')
-            }
-
-            # Create a list of (position, citation) tuples
-            citations = []
-            for support in grounding_supports:
-                segment = support.get('segment', {})
-                indices = support.get('grounding_chunk_indices', [])
-
-                if indices and segment and segment.get('end_index') is not None:
-                    end_index = segment['end_index']
-                    source_idx = indices[0]
-                    if source_idx in sources:
-                        citation = f"[[{source_idx + 1}]]({sources[source_idx]['link']})"
-                        citations.append((end_index, citation))
-
-            # Sort citations by position (end_index)
-            citations.sort(key=lambda x: x[0])
-
-            # Insert citations into the text
-            result = ""
-            last_pos = 0
-            for pos, citation in citations:
-                result += answer[last_pos:pos]
-                result += citation
-                last_pos = pos
-
-            # Add any remaining text
-            result += answer[last_pos:]
-
-            return result, sources
-
+            formatted, sources = render_citations(answer, response_dict, registry, fmt)
         except Exception as e:
             print(f"Error processing grounding metadata: {e}")
             return answer, {}
+        return formatted, sources
 
-    def search(self, query: str):
-        client = genai_client.Client(
-            api_key=os.environ.get("GEMINI_KEY")
-        )
-
-        model_id = "gemini-2.0-flash"
-
-        google_search_tool = types.Tool(
-            google_search=types.GoogleSearch()
-        )
+    @observe_phase("search")
+    async def search(self, query: str):
+        # Grounded searches are the most expensive calls, reuse recent results
+        cached = await asyncio.to_thread(self.search_cache.get, query, self.model_name)
+        if cached is not None:
+            return cached
 
         generation_config = {
             "temperature": 1,
@@ -411,22 +527,20 @@ class DeepSearch:
             "max_output_tokens": 8192,
             "response_mime_type": "text/plain",
             "response_modalities": ["TEXT"],
-            "tools": [google_search_tool]
         }
 
-        response = client.models.generate_content(
-            model=model_id,
-            contents=query,
-            config=generation_config
-        )
-
-        response_dict = response.model_dump()
+        response = await self.llm.generate_grounded(
+            query, generation_config, model_name=self.model_name, phase="search")
 
         formatted_text, sources = self.format_text_with_sources(
-            response_dict, response.text)
+            response.raw, response.text)
+
+        await asyncio.to_thread(
+            self.search_cache.put, query, self.model_name, formatted_text, sources)
 
         return formatted_text, sources
 
+    @observe_phase("process_result")
     async def process_result(
         self,
         query: str,
@@ -437,7 +551,9 @@ class DeepSearch:
         print(f"Processing result for query: {query}")
 
         user_prompt = f"""
-		Given the following result from a SERP search for the query <query>{query}</query>, generate a list of learnings from the result. Return a maximum of {num_learnings} learnings, but feel free to return less if the result is clear. Make sure each learning is unique and not similar to each other. The learnings should be concise and to the point, as detailed and information dense as possible. Make sure to include any entities like people, places, companies, products, things, etc in the learnings, as well as any exact metrics, numbers, or dates. The learnings will be used to research the topic further.
+		Given the following result from a SERP search for the query <query>{query}</query>, generate a list of learnings from the result. Return a maximum of {num_learnings} learnings, but feel free to return less if the result is clear. Make sure each learning is unique and not similar to each other. The learnings should be concise and to the point, as detailed and information dense as possible. Make sure to include any entities like people, places, companies, products, things, etc in the learnings, as well as any exact metrics, numbers, or dates. The learnings will be used to research the topic further. Also return a maximum of {num_follow_up_questions} follow up questions to research the topic further.
+
+		<result>{result}</result>
 		"""
 
         generation_config = {
@@ -467,12 +583,7 @@ class DeepSearch:
             ),
         }
 
-        model = genai.GenerativeModel(
-            "gemini-2.0-flash",
-            generation_config=generation_config,
-        )
-
-        response = model.generate_content(user_prompt)
+        response = await self.llm.generate(user_prompt, generation_config, phase="process_result")
         answer = response.text
 
         answer_json = json.loads(answer)
@@ -486,59 +597,178 @@ class DeepSearch:
 
         return answer_json
 
-    def _are_queries_similar(self, query1: str, query2: str) -> bool:
-        """Helper method to check if two queries are semantically similar using Gemini"""
-        user_prompt = f"""
-        Compare these two search queries and determine if they are semantically similar 
-        (i.e., would likely return similar search results or are asking about the same topic):
-
-        Query 1: {query1}
-        Query 2: {query2}
+    @staticmethod
+    def _node_key(path: tuple) -> str:
+        """Stable checkpoint key of a tree node, derived from its query path"""
+        return hashlib.sha1("\x1f".join(path).encode("utf-8")).hexdigest()
 
-        Consider:
-        1. Key concepts and entities
-        2. Intent of the queries
-        3. Scope and specificity
-        4. Core topic overlap
+    @staticmethod
+    def _restore_search(saved: list):
+        """Undo the JSON round trip of a checkpointed (text, sources) tuple"""
+        text, sources = saved
+        return text, {int(i): source for i, source in sources.items()}
 
-        Only respond with true if the queries are notably similar, false otherwise.
+    @observe_phase("process_result")
+    async def process_results_batch(
+        self,
+        items: list[tuple[str, str]],
+        num_learnings: int = 3,
+        num_follow_up_questions: int = 3,
+    ):
+        """
+        Extract learnings for several (query, result) pairs with one request.
+        Returns one {"learnings", "follow_up_questions"} dict per pair, in order.
         """
+        print(f"Processing {len(items)} results in one batch")
+
+        # ReplayBackend relies on this markup to split the batch into its results
+        results_text = "\n\n".join(
+            f'<result index="{i}">\n<query>{query}</query>\n{result}\n</result>'
+            for i, (query, result) in enumerate(items)
+        )
+
+        user_prompt = f"""
+		Below are the results of {len(items)} SERP searches, each with its index and query. For every result, generate a list of learnings from that result only. Return a maximum of {num_learnings} learnings per result, but feel free to return less if the result is clear. Make sure each learning is unique and not similar to each other. The learnings should be concise and to the point, as detailed and information dense as possible. Make sure to include any entities like people, places, companies, products, things, etc in the learnings, as well as any exact metrics, numbers, or dates. The learnings will be used to research the topic further. Also return a maximum of {num_follow_up_questions} follow up questions per result to research its query further.
+
+		Return one entry per result and set "query_index" to the index of the result it belongs to.
+
+		{results_text}
+		"""
 
         generation_config = {
-            "temperature": 0.1,  # Low temperature for more consistent results
+            "temperature": 1,
             "top_p": 0.95,
             "top_k": 40,
             "max_output_tokens": 8192,
             "response_mime_type": "application/json",
             "response_schema": content.Schema(
                 type=content.Type.OBJECT,
-                required=["are_similar"],
+                enum=[],
+                required=["results"],
                 properties={
-                    "are_similar": content.Schema(
-                        type=content.Type.BOOLEAN,
-                        description="True if queries are semantically similar, false otherwise"
-                    )
-                }
-            )
+                    "results": content.Schema(
+                        type=content.Type.ARRAY,
+                        items=content.Schema(
+                            type=content.Type.OBJECT,
+                            enum=[],
+                            required=["query_index", "learnings", "follow_up_questions"],
+                            properties={
+                                "query_index": content.Schema(type=content.Type.INTEGER),
+                                "learnings": content.Schema(
+                                    type=content.Type.ARRAY,
+                                    items=content.Schema(
+                                        type=content.Type.STRING
+                                    )
+                                ),
+                                "follow_up_questions": content.Schema(
+                                    type=content.Type.ARRAY,
+                                    items=content.Schema(
+                                        type=content.Type.STRING
+                                    )
+                                )
+                            },
+                        ),
+                    ),
+                },
+            ),
         }
 
-        try:
-            model = genai.GenerativeModel(
-                "gemini-2.0-flash",
-                generation_config=generation_config,
-            )
+        # The batch is shared by all of its queries in the run's usage records
+        current_node.set([query for query, _ in items])
+        response = await self.llm.generate(user_prompt, generation_config, phase="process_result")
+        answer_json = json.loads(response.text)
+
+        answers = [{"learnings": [], "follow_up_questions": []} for _ in items]
+        for entry in answer_json["results"]:
+            index = int(entry.get("query_index", -1))
+            if 0 <= index < len(items):
+                answers[index] = {
+                    "learnings": entry.get("learnings", []),
+                    "follow_up_questions": entry.get("follow_up_questions", [])
+                }
 
-            response = model.generate_content(user_prompt)
-            answer = json.loads(response.text)
-            return answer["are_similar"]
-        except Exception as e:
-            print(f"Error comparing queries: {str(e)}")
-            # In case of error, assume queries are different to avoid missing potentially unique results
-            return False
+        for (query, _), answer in zip(items, answers):
+            print(f"Results from {query}:")
+            print(f"Learnings: {answer['learnings']}\n")
+            print(f"Follow up questions: {answer['follow_up_questions']}\n")
+
+        return answers
+
+    @observe_phase("prefetch")
+    async def prefetch(self, query: str, breadth: int, results: dict = None) -> dict:
+        """
+        Speculatively run the first level of searches for `query`, e.g. while
+        the user is still answering follow-up questions. Searches stop once
+        the run's limits are reached. Finished searches are added to
+        `results` (query -> (text, sources)) as they complete, so a caller
+        can use them before the whole level is done.
+        """
+        results = {} if results is None else results
+        max_queries = {"fast": 3, "balanced": 7, "comprehensive": 5}[self.mode]
+        queries = await self.generate_queries(query, min(breadth, max_queries))
+        queries = self.query_index.filter_new(queries)[:breadth]
+        self.query_index.add(queries)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def prefetch_query(query_str: str):
+            async with semaphore:
+                if not self.usage.fits(calls=1):
+                    return
+                current_node.set(query_str)
+                try:
+                    results[query_str] = await self.search(query_str)
+                except Exception as e:
+                    print(f"Error prefetching query {query_str}: {str(e)}")
+
+        await asyncio.gather(*(prefetch_query(q) for q in queries))
+        return results
+
+    @observe_phase("deep_research")
+    async def deep_research(self, query: str, breadth: int, depth: int, learnings: list[str] = [], visited_urls: dict[int, dict] = {}, parent_query: str = None, run_id: str = None,
+                            prefetched: dict = None, deadline_seconds: float = None):
+        """
+        Research `query` as a tree of searches. Every finished step is
+        checkpointed under `run_id`; calling again with the same run id
+        resumes the run and only re-issues the steps that did not finish.
+
+        `prefetched` holds searches from `prefetch`, query -> (text,
+        sources). A first-level query uses the most similar prefetched search
+        reaching PREFETCH_SIMILARITY_THRESHOLD instead of searching again;
+        prefetched searches that match no query are dropped.
+
+        With `deadline_seconds`, research stops in time to leave
+        DEADLINE_REPORT_SHARE of the deadline (or the slowest call so far)
+        for the final report: queries still running are cancelled, no
+        deeper level is started, and the report is written from what was
+        collected. The returned coverage lists the queries that finished and
+        those that were cancelled.
+
+        The returned visited_urls is keyed by the run's stable source ids,
+        which learning_sources refers to and the report cites.
+        """
+        started = time.monotonic()
+        run_id = run_id or str(uuid.uuid4())
+        await asyncio.to_thread(self.checkpoints.save_run, run_id, {
+            "query": query,
+            "breadth": breadth,
+            "depth": depth,
+            "mode": self.mode,
+        })
+        checkpoint = await asyncio.to_thread(self.checkpoints.load, run_id)
+        if checkpoint:
+            print(f"Resuming research run {run_id} from {len(checkpoint)} checkpoints")
+
+        async def save(key: str, value):
+            await asyncio.to_thread(self.checkpoints.put, run_id, key, value)
 
-    async def deep_research(self, query: str, breadth: int, depth: int, learnings: list[str] = [], visited_urls: dict[int, dict] = {}, parent_query: str = None):
         progress = ResearchProgress(depth, breadth)
-        
+        for listener in self.listeners:
+            progress.add_listener(listener)
+
+        # Every source of the run gets one stable id, used for citations
+        registry = SourceRegistry(visited_urls)
+
         # Start the root query
         progress.start_query(query, depth, parent_query)
 
@@ -549,112 +779,299 @@ class DeepSearch:
             "comprehensive": 5 # kept lower than balanced due to recursive multiplication
         }[self.mode]
 
-        queries = self.generate_queries(
-            query,
-            min(breadth, max_queries),
-            learnings,
-            previous_queries=self.query_history
+        def slowest_call() -> float:
+            return max((record["latency"] for record in self.usage.records), default=0.0)
+
+        def research_cutoff() -> float:
+            """Monotonic time by which research has to stop to meet the deadline"""
+            reserve = max(DEADLINE_REPORT_SHARE * deadline_seconds, slowest_call())
+            return started + deadline_seconds - reserve
+
+        deadline_reached = False
+        plan_key = "plan:" + self._node_key((query,))
+        if plan_key in checkpoint:
+            # Reuse the queries generated before the interruption
+            unique_queries = checkpoint[plan_key]
+        else:
+            planning = self.generate_queries(
+                query,
+                min(breadth, max_queries),
+                learnings,
+                previous_queries=self.query_index.recent(20)
+            )
+            try:
+                # Planning counts against the deadline like the searches do
+                timeout = None if deadline_seconds is None else max(0.0, research_cutoff() - time.monotonic())
+                queries = await asyncio.wait_for(planning, timeout)
+            except asyncio.TimeoutError:
+                print("Research deadline reached while planning the queries")
+                deadline_reached = True
+                queries = []
+
+            # Drop near-duplicates of each other and of earlier queries locally,
+            # before any search is spent on them
+            unique_queries = self.query_index.filter_new(queries)[:breadth]
+            if not deadline_reached:
+                await save(plan_key, unique_queries)
+        self.query_index.add(unique_queries)
+        self.query_history.update(unique_queries)
+
+        reused_searches = {}
+        if prefetched:
+            prefetched_queries = list(prefetched)
+            matches = match_texts(unique_queries, prefetched_queries, PREFETCH_SIMILARITY_THRESHOLD)
+            reused_searches = {
+                unique_queries[i]: prefetched[prefetched_queries[j]] for i, j in matches.items()
+            }
+            print(f"Reusing {len(reused_searches)} of {len(prefetched)} prefetched searches")
+
+        num_learnings = min(3, math.ceil(breadth / 2))
+        num_follow_up_questions = min(2, math.ceil(breadth / 2))
+
+        # Sibling queries share one extraction request per batch
+        batcher = ExtractionBatcher(
+            lambda query_str, result: self.process_result(
+                query_str, result, num_learnings, num_follow_up_questions),
+            lambda items: self.process_results_batch(
+                items, num_learnings, num_follow_up_questions),
+            batch_size=self.extraction_batch_size,
+            token_budget=self.extraction_token_budget
         )
 
-        self.query_history.update(queries)
-        unique_queries = list(queries)[:breadth]
-
-        async def process_query(query_str: str, current_depth: int, parent: str = None):
+        async def process_query(query_str: str, current_depth: int, parent: str = None, path: tuple = ()):
+            path = path + (query_str,)
+            node_key = self._node_key(path)
+            announced = False
             try:
                 # Start this query as a sub-query of the parent
                 progress.start_query(query_str, current_depth, parent)
 
-                result = self.search(query_str)
-                processed_result = await self.process_result(
-                    query=query_str,
-                    result=result[0],
-                    num_learnings=min(3, math.ceil(breadth / 2)),
-                    num_follow_up_questions=min(2, math.ceil(breadth / 2))
-                )
+                saved_node = checkpoint.get("node:" + node_key)
+                saved_search = checkpoint.get("search:" + node_key)
+                if saved_node is None:
+                    batcher.expect()
+                    announced = True
+                if saved_node is not None:
+                    result = self._restore_search(saved_node["search"])
+                elif saved_search is not None:
+                    result = self._restore_search(saved_search)
+                elif query_str in reused_searches and current_depth == depth:
+                    result = self._restore_search(reused_searches[query_str])
+                    await save("search:" + node_key, result)
+                else:
+                    result = await self.search(query_str)
+                    await save("search:" + node_key, result)
+
+                if saved_node is not None:
+                    processed_result = saved_node["processed"]
+                else:
+                    announced = False
+                    processed_result = await batcher.submit(query_str, result[0])
+                    await save("node:" + node_key, {
+                        "query": query_str,
+                        "depth": current_depth,
+                        "search": result,
+                        "processed": processed_result
+                    })
 
                 # Record learnings
                 for learning in processed_result["learnings"]:
                     progress.add_learning(query_str, current_depth, learning)
 
-                new_urls = result[1]
-                max_idx = max(visited_urls.keys()) if visited_urls else -1
-                all_urls = {
-                    **visited_urls,
-                    **{(i + max_idx + 1): url_data for i, url_data in new_urls.items()}
-                }
-
-                # Only go deeper if in comprehensive mode and depth > 1
-                if self.mode == "comprehensive" and current_depth > 1:
-                    # Reduced breadth for deeper levels
-                    new_breadth = min(2, math.ceil(breadth / 2))
-                    new_depth = current_depth - 1
-
-                    # Select most important follow-up question instead of using all
-                    if processed_result['follow_up_questions']:
-                        # Take only the most relevant question
-                        next_query = processed_result['follow_up_questions'][0]
-                        
-                        # Process the sub-query
-                        sub_results = await process_query(
-                            next_query,
-                            new_depth,
-                            query_str  # Pass current query as parent
-                        )
-
-                progress.complete_query(query_str, current_depth)
                 return {
                     "learnings": processed_result["learnings"],
-                    "visited_urls": all_urls
+                    "sources": list(result[1].values()),  # Registered once the level is done
+                    "follow_up_questions": processed_result["follow_up_questions"]
                 }
 
+            except asyncio.CancelledError:
+                if announced:
+                    batcher.withdraw()
+                raise
             except Exception as e:
                 print(f"Error processing query {query_str}: {str(e)}")
-                progress.complete_query(query_str, current_depth)
+                if announced:
+                    batcher.withdraw()
+                progress.fail_query(query_str, current_depth)
                 return {
                     "learnings": [],
-                    "visited_urls": {}
+                    "sources": [],
+                    "follow_up_questions": []
                 }
 
-        # Process queries concurrently
-        tasks = [process_query(q, depth, query) for q in unique_queries]
-        results = await asyncio.gather(*tasks)
-
-        # Combine results
-        all_learnings = list(set(
-            learning
-            for result in results
-            for learning in result["learnings"]
-        ))
-
-        all_urls = {}
-        current_idx = 0
-        seen_urls = set()
+        deadline_pruned = False
+
+        def affordable(count: int, level_seconds: float) -> int:
+            """How many of `count` more nodes fit the run's limits, leaving room for the report"""
+            nonlocal deadline_pruned
+            _, tokens_per_node = self.usage.cost_per_node()
+            slowest = slowest_call()
+            # With a deadline, a level that would be cancelled before it finished is not started
+            in_time = deadline_seconds is None or time.monotonic() + level_seconds <= research_cutoff()
+            fitting = 0
+            while in_time and fitting < count and self.usage.fits(
+                    calls=(fitting + 1) * MAX_CALLS_PER_NODE + 1,
+                    tokens=(fitting + 1) * tokens_per_node + REPORT_TOKEN_RESERVE,
+                    seconds=(level_seconds or 2 * slowest) + slowest):
+                fitting += 1
+            if fitting < count:
+                deadline_pruned = deadline_pruned or not in_time
+                self.usage.pruned += count - fitting
+                print(f"Run budget nearly spent, pruning {count - fitting} of {count} queries")
+            return fitting
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_node(node: tuple):
+            async with semaphore:
+                current_node.set(node[0])
+                return await process_query(*node)
+
+        # Expand the tree level by level: every node of the frontier runs
+        # concurrently (up to max_concurrency), then the next frontier is built
+        # from their follow-up questions. Only comprehensive mode goes deeper.
+        # A run near its limits researches fewer queries (breadth) and stops
+        # expanding (depth) so the final report can still be written; at its
+        # deadline, the queries of the current level that are still running
+        # are cancelled.
+        frontier = [(q, depth, query, (query,)) for q in unique_queries][:self.max_nodes]
+        fitting = affordable(len(frontier), 0.0)
+        progress.prune_queries([q for q, _, _, _ in frontier[fitting:]])
+        frontier = frontier[:fitting]
+        self.usage.plan(len(frontier) * MAX_CALLS_PER_NODE + 1)
+        breadths = {q: breadth for q in unique_queries}
+        nodes_scheduled = len(frontier)
+        results = []
+        while frontier:
+            level_started = time.monotonic()
+            tasks = [asyncio.ensure_future(run_node(node)) for node in frontier]
+            timeout = None if deadline_seconds is None else max(0.0, research_cutoff() - level_started)
+            try:
+                _, pending = await asyncio.wait(tasks, timeout=timeout)
+            except asyncio.CancelledError:
+                # The run itself was cancelled, e.g. by a disconnected client:
+                # stop its branches too, so none of them keeps calling the model
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await batcher.cancel()
+                raise
+            if pending:
+                # Out of time: drop the branches still running, keep what finished
+                deadline_reached = True
+                print(f"Research deadline reached, cancelling {len(pending)} of {len(tasks)} queries")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                await batcher.cancel()
+            level_results = [None if task.cancelled() else task.result() for task in tasks]
+            # Sources get their ids in frontier order rather than in the order
+            # the searches finished, so a run always numbers its citations alike
+            for (query_str, current_depth, _, _), result in zip(frontier, level_results):
+                if result is None:
+                    continue
+                result["sources"] = registry.add_many(result["sources"])
+                if result["sources"]:
+                    self._emit({
+                        "type": "sources_discovered",
+                        "query": query_str,
+                        "depth": current_depth,
+                        "sources": [registry.get(source_id) for source_id in result["sources"]]
+                    })
+            level_seconds = time.monotonic() - level_started
+            results.extend(result for result in level_results if result is not None)
+
+            candidates = []
+            for (query_str, current_depth, parent_query, path), result in zip(frontier, level_results):
+                if result is None:
+                    progress.cancel_query(query_str, current_depth, parent_query)
+                    continue
+                if self.mode == "comprehensive" and current_depth > 1 and not deadline_reached:
+                    # Each node expands into its own, narrower set of follow-ups
+                    child_breadth = min(2, math.ceil(breadths.get(query_str, breadth) / 2))
+                    children = self.query_index.filter_new(result["follow_up_questions"])[:child_breadth]
+                    self.query_index.add(children)
+                    for child in children:
+                        breadths[child] = child_breadth
+                        candidates.append((child, current_depth - 1, query_str, path + (query_str,)))
+            if candidates:
+                limit = min(len(candidates), max(0, self.max_nodes - nodes_scheduled))
+                fitting = affordable(limit, level_seconds)
+                progress.prune_queries([child for child, _, _, _ in candidates[fitting:limit]])
+                candidates = candidates[:fitting]
+
+            next_frontier = candidates
+            self.query_history.update(child for child, _, _, _ in next_frontier)
+            nodes_scheduled += len(next_frontier)
+            # Retries and hedges must leave the level's calls and the report's
+            self.usage.plan(len(next_frontier) * MAX_CALLS_PER_NODE + 1)
+            parents = {parent for _, _, parent, _ in next_frontier}
+            for (query_str, current_depth, _, _), result in zip(frontier, level_results):
+                if result is not None and query_str not in parents:
+                    # Nodes with children complete once their last child does
+                    progress.complete_query(query_str, current_depth)
+            frontier = next_frontier
+        # Levels skipped because they would not finish in time count as the deadline too
+        deadline_reached = deadline_reached or deadline_pruned
+
+        # Combine results: every learning keeps the sources of the searches it
+        # came from, and paraphrases from sibling branches are merged
+        learning_sources = {}
         for result in results:
-            for url_data in result["visited_urls"].values():
-                if url_data['link'] not in seen_urls:
-                    all_urls[current_idx] = url_data
-                    seen_urls.add(url_data['link'])
-                    current_idx += 1
+            for learning in result["learnings"]:
+                learning_sources.setdefault(learning, []).extend(result["sources"])
+        clusters = consolidate(
+            list(learning_sources), list(learning_sources.values()),
+            threshold=self.learning_similarity_threshold
+        )
+        all_learnings = [learning for learning, _ in clusters]
+        if len(all_learnings) < len(learning_sources):
+            print(f"Consolidated {len(learning_sources)} learnings into {len(all_learnings)}")
 
         # Complete the root query after all sub-queries are done
         progress.complete_query(query, depth)
 
-        # save the tree structure to a json file
-        with open("research_tree.json", "w") as f:
-            json.dump(progress._build_research_tree(), f)
+        tree = progress._build_research_tree()
+        # Keep the run's artifact under its run id; the report is added by the caller
+        await asyncio.to_thread(self.artifacts.save, run_id, {
+            "query": query,
+            "tree": tree,
+            "learnings": all_learnings,
+            "learning_sources": dict(clusters),
+            "visited_urls": registry.as_dict(),
+        })
+
+        coverage = progress.coverage()
+        coverage.update(deadline_seconds=deadline_seconds, deadline_reached=deadline_reached)
 
         return {
             "learnings": all_learnings,
-            "visited_urls": all_urls
+            "visited_urls": registry.as_dict(),
+            "learning_sources": dict(clusters),
+            "tree": tree,
+            "run_id": run_id,
+            "usage": self.usage.totals(),
+            "coverage": coverage
         }
 
-    def generate_final_report(self, query: str, learnings: list[str], visited_urls: dict[int, dict]) -> str:
-        # Format sources and learnings for the prompt
+    @staticmethod
+    def _source_refs(source_ids: list[int]) -> str:
+        return f" [{', '.join(str(source_id) for source_id in source_ids)}]" if source_ids else ""
+
+    def _final_report_request(self, query: str, learnings: list[str], visited_urls: dict[int, dict],
+                              learning_sources: dict = None):
+        """Build the prompt and generation config for the final report"""
+        # Format sources and learnings for the prompt, with the source ids
+        # that citations refer to
+        learning_sources = learning_sources or {}
         sources_text = "\n".join([
-            f"- {data['title']}: {data['link']}"
-            for data in visited_urls.values()
+            f"- [{source_id}] {data['title']}: {data['link']}"
+            for source_id, data in visited_urls.items()
+        ])
+        learnings_text = "\n".join([
+            f"- {learning}{self._source_refs(learning_sources.get(learning))}"
+            for learning in learnings
         ])
-        learnings_text = "\n".join([f"- {learning}" for learning in learnings])
 
         user_prompt = f"""
         You are a creative research analyst tasked with synthesizing findings into an engaging and informative report.
@@ -699,7 +1116,7 @@ class DeepSearch:
         - Must maintain factual accuracy
         - Must be well-organized and easy to follow
         - Must include clear conclusions and insights
-        - Must cite sources appropriately
+        - Must cite sources by their number in square brackets, e.g. [3] or [2, 5]
         
         Be bold and creative in your approach while ensuring the report effectively communicates all the important information!
         """
@@ -711,25 +1128,261 @@ class DeepSearch:
             "max_output_tokens": 8192,
         }
 
-        model = genai.GenerativeModel(
-            "gemini-2.0-flash",
-            generation_config=generation_config,
+        return user_prompt, generation_config
+
+    def _sources_section(self, visited_urls: dict[int, dict]) -> str:
+        return "\n# Sources\n" + "\n".join([
+            f"{source_id}. [{data['title']}]({data['link']})"
+            for source_id, data in visited_urls.items()
+        ])
+
+    @staticmethod
+    def _subtree_findings(node: dict, keep: set) -> list:
+        """(query, learnings) of a research tree node and its descendants"""
+        findings = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            learnings = [learning for learning in current["learnings"] if learning in keep]
+            if learnings:
+                findings.append((current["query"], learnings))
+            stack.extend(reversed(current["sub_queries"]))
+        return findings
+
+    def _map_reduce_calls(self, learnings: list[str], tree: dict) -> int:
+        """Model calls a map-reduce report of `tree` makes: its sections, subsections included, and the merge"""
+        keep = set(learnings)
+        return sum(self._section_calls(child, keep) for child in tree["sub_queries"]) + 1
+
+    def _use_map_reduce(self, learnings: list[str], tree: dict) -> bool:
+        if not tree or len(tree.get("sub_queries", [])) < 2:
+            return False
+        if self.report_synthesis == "map_reduce":
+            # Even when asked for, the sections must fit the run's call limit
+            if self.usage.fits(calls=self._map_reduce_calls(learnings, tree)):
+                return True
+            print("Not enough model calls left for a map-reduce report, writing it in one call")
+            return False
+        if self.report_synthesis != "auto" or len(learnings) < MAP_REDUCE_MIN_LEARNINGS:
+            return False
+        # Every section plus the merge must fit the run's limits
+        return self.usage.fits(calls=self._map_reduce_calls(learnings, tree), tokens=REPORT_TOKEN_RESERVE)
+
+    async def _write_section(self, query: str, topic: str, level: int, findings: list,
+                             subtopics: list[str], learning_sources: dict, visited_urls: dict[int, dict]) -> str:
+        """Draft one report section from the findings of a research subtree"""
+        source_ids = {}
+        for _, learnings in findings:
+            for learning in learnings:
+                source_ids.update(dict.fromkeys(learning_sources.get(learning, [])))
+        sources = [
+            {"id": source_id, **visited_urls[source_id]}
+            for source_id in source_ids
+            if source_id in visited_urls
+        ]
+        findings_text = "\n\n".join(
+            f"Findings for \"{finding_query}\":\n" + "\n".join(
+                f"- {learning}{self._source_refs(learning_sources.get(learning))}" for learning in learnings)
+            for finding_query, learnings in findings
+        )
+        subtopics_text = ""
+        if subtopics:
+            subtopics_text = "\n\nThe following subtopics get their own subsections right after this one, " \
+                "so only introduce them briefly:\n" + "\n".join(f"- {subtopic}" for subtopic in subtopics)
+        sources_text = "\n".join(f"- [{source['id']}] {source['title']}: {source['link']}" for source in sources)
+
+        user_prompt = f"""
+        You are writing one section of a research report on the query <query>{query}</query>.
+        This section covers the research thread <topic>{topic}</topic>.
+
+        Write the section in markdown, starting with a level {level} heading ("{'#' * level} "). Use the
+        findings below, keep every data point, and cite the sources where they support a claim by their number
+        in square brackets, e.g. [3] or [2, 5]. Do not write an introduction or conclusion for the whole report.
+
+        {findings_text}{subtopics_text}
+
+        Sources:
+        {sources_text}
+        """
+
+        generation_config = {
+            "temperature": 0.9,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 8192,
+        }
+
+        response = await self.llm.generate(
+            user_prompt, generation_config, priority=Priority.REPORT, phase="generate_final_report")
+        return response.text.strip()
+
+    def _section_calls(self, node: dict, keep: set) -> int:
+        """Calls _draft_sections makes for a subtree"""
+        findings = self._subtree_findings(node, keep)
+        if not findings:
+            return 0
+        size = estimate_tokens("".join(learning for _, learnings in findings for learning in learnings))
+        if size <= SECTION_TOKEN_BUDGET or not node["sub_queries"]:
+            return 1
+        return 1 + sum(self._section_calls(child, keep) for child in node["sub_queries"])
+
+    async def _draft_sections(self, query: str, node: dict, level: int, keep: set,
+                              learning_sources: dict, visited_urls: dict[int, dict]) -> list[str]:
+        """
+        Draft the sections of a research subtree. A subtree that fits
+        SECTION_TOKEN_BUDGET is written in one call; a larger one gets a
+        section for its own findings and its children are drafted as
+        subsections, all concurrently.
+        """
+        findings = self._subtree_findings(node, keep)
+        if not findings:
+            return []
+        size = estimate_tokens("".join(learning for _, learnings in findings for learning in learnings))
+        if size <= SECTION_TOKEN_BUDGET or not node["sub_queries"]:
+            return [await self._write_section(
+                query, node["query"], level, findings, [], learning_sources, visited_urls)]
+
+        own = [learning for learning in node["learnings"] if learning in keep]
+        own_findings = [(node["query"], own)] if own else []
+        subtopics = [child["query"] for child in node["sub_queries"]]
+        drafts = await asyncio.gather(
+            self._write_section(query, node["query"], level, own_findings, subtopics, learning_sources, visited_urls),
+            *(self._draft_sections(query, child, level + 1, keep, learning_sources, visited_urls)
+              for child in node["sub_queries"])
+        )
+        return [drafts[0]] + [section for child_sections in drafts[1:] for section in child_sections]
+
+    async def _merge_sections(self, query: str, sections: list[str]) -> dict:
+        """Write the title, introduction, transitions and conclusion around the section drafts"""
+        sections_text = "\n\n".join(
+            f"<section index=\"{i}\">\n{section[:MERGE_SECTION_CHARS]}\n</section>"
+            for i, section in enumerate(sections)
         )
 
+        user_prompt = f"""
+        You are assembling a research report on the query <query>{query}</query> from sections that were
+        drafted separately (long sections are shortened here). The sections are kept as they are and in this
+        order. Write a title, an engaging introduction that frames the whole report, one short transition
+        paragraph to place before each section that connects it with what came before, and a conclusion with
+        the key insights across all sections.
+
+        {sections_text}
+        """
+
+        generation_config = {
+            "temperature": 0.9,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 8192,
+            "response_mime_type": "application/json",
+            "response_schema": content.Schema(
+                type=content.Type.OBJECT,
+                enum=[],
+                required=["title", "introduction", "transitions", "conclusion"],
+                properties={
+                    "title": content.Schema(type=content.Type.STRING),
+                    "introduction": content.Schema(type=content.Type.STRING),
+                    "transitions": content.Schema(
+                        type=content.Type.ARRAY,
+                        items=content.Schema(type=content.Type.STRING),
+                    ),
+                    "conclusion": content.Schema(type=content.Type.STRING),
+                },
+            ),
+        }
+
+        response = await self.llm.generate(
+            user_prompt, generation_config, priority=Priority.REPORT, phase="generate_final_report")
+        return json.loads(response.text)
+
+    async def _map_reduce_report(self, query: str, learnings: list[str], visited_urls: dict[int, dict],
+                                 tree: dict, learning_sources: dict) -> list[str]:
+        """
+        Write the report as one section per research subtree, drafted
+        concurrently, and merge them with a final call that only writes the
+        connecting text, so the report is not bounded by one response.
+        Returns the report parts in order.
+        """
+        print(f"Synthesizing report from {len(tree['sub_queries'])} research threads...\n")
+        # Retries and hedges must leave the section and merge calls alone
+        self.usage.plan(self._map_reduce_calls(learnings, tree))
+        keep = set(learnings)
+        drafted = await asyncio.gather(*(
+            self._draft_sections(query, child, 2, keep, learning_sources or {}, visited_urls)
+            for child in tree["sub_queries"]
+        ))
+        threads = [link_citations("\n\n".join(sections), visited_urls) for sections in drafted if sections]
+        merge = await self._merge_sections(query, threads)
+
+        transitions = merge.get("transitions", [])
+        parts = [f"# {merge['title']}\n\n{merge['introduction']}\n\n"]
+        for i, thread in enumerate(threads):
+            transition = transitions[i] if i < len(transitions) else ""
+            parts.append((f"{transition}\n\n" if transition else "") + thread + "\n\n")
+        parts.append(f"## Conclusion\n\n{merge['conclusion']}\n")
+        return parts
+
+    @observe_phase("generate_final_report")
+    async def generate_final_report(self, query: str, learnings: list[str], visited_urls: dict[int, dict],
+                                    tree: dict = None, learning_sources: dict = None) -> str:
+        """
+        Write the final report. `tree` and `learning_sources`, as returned by
+        deep_research, enable map-reduce synthesis for large runs.
+        """
+        if self._use_map_reduce(learnings, tree):
+            parts = await self._map_reduce_report(query, learnings, visited_urls, tree, learning_sources)
+            return "".join(parts) + self._sources_section(visited_urls)
+
+        user_prompt, generation_config = self._final_report_request(
+            query, learnings, visited_urls, learning_sources)
+
         print("Generating final report...\n")
 
-        response = model.generate_content(user_prompt)
+        response = await self.llm.generate(
+            user_prompt, generation_config, priority=Priority.REPORT, phase="generate_final_report")
 
-        # Format the response with inline citations
+        # Format the response with inline citations that resolve to the run's source ids
         formatted_text, sources = self.format_text_with_sources(
-            response.to_dict(),
-            response.text
+            response.raw,
+            response.text,
+            registry=SourceRegistry(visited_urls)
         )
 
         # Add sources section
-        sources_section = "\n# Sources\n" + "\n".join([
-            f"- [{data['title']}]({data['link']})"
-            for data in visited_urls.values()
-        ])
+        return link_citations(formatted_text, visited_urls) + self._sources_section(visited_urls)
 
-        return formatted_text + sources_section
+    @observe_phase("generate_final_report")
+    async def generate_final_report_stream(self, query: str, learnings: list[str], visited_urls: dict[int, dict],
+                                           tree: dict = None, learning_sources: dict = None):
+        """
+        Stream the final report as the model writes it, with citations spliced
+        in as their grounding supports arrive and the Sources section last.
+        Map-reduce reports are yielded part by part once merged.
+        """
+        if self._use_map_reduce(learnings, tree):
+            for part in await self._map_reduce_report(query, learnings, visited_urls, tree, learning_sources):
+                yield part
+            yield self._sources_section(visited_urls)
+            return
+
+        user_prompt, generation_config = self._final_report_request(
+            query, learnings, visited_urls, learning_sources)
+
+        print("Streaming final report...\n")
+
+        formatter = StreamingCitationFormatter(registry=SourceRegistry(visited_urls))
+        pending = ""
+        async for chunk in self.llm.generate_stream(
+                user_prompt, generation_config, priority=Priority.REPORT, phase="generate_final_report"):
+            text = formatter.feed(chunk.text, chunk.raw)
+            if text:
+                # Hold back a citation that the next chunk may complete
+                text, pending = split_partial_citation(pending + text)
+                if text:
+                    yield link_citations(text, visited_urls)
+
+        remaining = pending + formatter.finish()
+        if remaining:
+            yield link_citations(remaining, visited_urls)
+
+        yield self._sources_section(visited_urls)
@@ -0,0 +1,85 @@
+from collections import deque
+import asyncio
+import json
+
+
+# Progress updates that may be dropped when a slow consumer falls behind.
+# Everything else (report text, results, errors) is always delivered.
+DROPPABLE_EVENTS = {"query_started", "learning_added", "query_completed", "sources_discovered"}
+
+
+class EventChannel:
+    """
+    Bounded buffer between a research run and a streaming consumer.
+
+    `publish` is synchronous and never blocks the producer: once the buffer
+    is full, droppable progress events are discarded and reported to the
+    consumer as a single `lagged` event. `send` is for essential events and
+    waits for room in the buffer, so a slow client applies backpressure to
+    the report stream instead of growing memory without bound.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self.dropped = 0
+        self.closed = False
+        self._buffer = deque()
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._next_id = 0
+
+    def _append(self, event: dict):
+        self._buffer.append(event)
+        self._readable.set()
+        if len(self._buffer) >= self.max_size:
+            self._writable.clear()
+
+    def publish(self, event: dict):
+        """Queue an event without waiting, dropping progress events on overflow"""
+        if self.closed:
+            return
+        if len(self._buffer) >= self.max_size and event.get("type") in DROPPABLE_EVENTS:
+            self.dropped += 1
+            return
+        self._append(event)
+
+    async def send(self, event: dict):
+        """Queue an event, waiting while the buffer is full"""
+        while not self.closed and len(self._buffer) >= self.max_size:
+            await self._writable.wait()
+        if not self.closed:
+            self._append(event)
+
+    def close(self):
+        self.closed = True
+        self._readable.set()
+        self._writable.set()
+
+    def _format(self, event: dict) -> str:
+        self._next_id += 1
+        return f"id: {self._next_id}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    async def stream(self, heartbeat_interval: float = 15.0):
+        """Yield Server-Sent Events until the channel is closed and drained"""
+        while True:
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                yield self._format({"type": "lagged", "dropped_events": dropped})
+
+            if self._buffer:
+                event = self._buffer.popleft()
+                if len(self._buffer) < self.max_size:
+                    self._writable.set()
+                yield self._format(event)
+                continue
+
+            if self.closed:
+                return
+
+            self._readable.clear()
+            try:
+                await asyncio.wait_for(self._readable.wait(), heartbeat_interval)
+            except asyncio.TimeoutError:
+                # SSE comment line, keeps proxies from closing an idle connection
+                yield ": heartbeat\n\n"
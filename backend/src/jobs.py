@@ -0,0 +1,259 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+
+class JobStore:
+    """
+    Durable queue of research jobs backed by SQLite.
+
+    Jobs move through queued -> running -> completed / failed. Because the
+    queue lives on disk, queued and finished jobs survive a server restart.
+    A running job is leased to the worker that claimed it, which renews the
+    lease with `heartbeat`; jobs whose lease ran out because their process
+    died are queued again. Several processes can share one store.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 60.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                heartbeat_at REAL
+            )
+            """
+        )
+        # Stores created before leases existed lack their columns
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.commit()
+
+    def enqueue(self, request: dict) -> str:
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, request, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(request), time.time()),
+            )
+            self._conn.commit()
+        return job_id
+
+    def claim_next(self, owner: str):
+        """Lease the oldest queued job to `owner` and return (id, request)"""
+        with self._lock:
+            while True:
+                row = self._conn.execute(
+                    "SELECT id, request FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                # Another process may claim the same job in between; only one update wins
+                now = time.time()
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, started_at = ?, heartbeat_at = ? "
+                    "WHERE id = ? AND status = 'queued'",
+                    (owner, now, now, row[0]),
+                )
+                self._conn.commit()
+                if cursor.rowcount == 1:
+                    return row[0], json.loads(row[1])
+
+    def heartbeat(self, job_id: str, owner: str) -> bool:
+        """Renew the lease of a running job; False if `owner` no longer holds it"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time(), job_id, owner),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, owner: str, result: dict) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'completed', result = ?, finished_at = ? "
+                "WHERE id = ? AND owner = ? AND status = 'running'",
+                (json.dumps(result), time.time(), job_id, owner),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, owner: str, error: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                "WHERE id = ? AND owner = ? AND status = 'running'",
+                (error, time.time(), job_id, owner),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def requeue_expired(self) -> int:
+        """Queue running jobs again whose lease expired, e.g. because their process died"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, started_at = NULL, heartbeat_at = NULL "
+                "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (time.time() - self.lease_seconds,),
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, request, result, error, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "request": json.loads(row[2]),
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "created_at": row[5],
+            "started_at": row[6],
+            "finished_at": row[7],
+        }
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """Return the process-wide job store, stored at JOB_STORE_PATH"""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore(
+                os.getenv("JOB_STORE_PATH", os.path.join(".cache", "jobs.sqlite3")),
+                lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60")),
+            )
+        return _job_store
+
+
+class WorkerPool:
+    """
+    Fixed pool of worker threads draining a JobStore, the process-wide one
+    unless `store` is given.
+
+    Each worker runs one job at a time on its own event loop by calling the
+    async `handler` with the job id and request dict; the returned dict is
+    stored as the job result. Workers sleep until `notify` is called or the
+    poll interval elapses. A maintenance thread renews the leases of the
+    running jobs and queues again the jobs of processes that died.
+    """
+
+    def __init__(self, handler, workers: int = 2, poll_interval: float = 1.0, store: JobStore = None):
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._store = store
+        self._running = set()  # Ids of the jobs this pool's workers are running
+        self._running_lock = threading.Lock()
+        self._threads = []
+        self._stopping = threading.Event()
+        self._wakeup = threading.Condition()
+
+    @property
+    def store(self) -> JobStore:
+        if self._store is None:
+            self._store = get_job_store()
+        return self._store
+
+    def start(self):
+        self._requeue_expired()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"research-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, name="research-leases", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        self.notify()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _requeue_expired(self):
+        requeued = self.store.requeue_expired()
+        if requeued:
+            print(f"Re-queued {requeued} interrupted research jobs")
+            self.notify()
+
+    def _maintain(self):
+        # Renew leases well before they run out
+        while not self._stopping.wait(self.store.lease_seconds / 3):
+            with self._running_lock:
+                running = list(self._running)
+            for job_id in running:
+                if not self.store.heartbeat(job_id, self.owner):
+                    print(f"Lost the lease of research job {job_id}")
+            self._requeue_expired()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.store.claim_next(self.owner)
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+
+            job_id, request = job
+            print(f"Worker {threading.current_thread().name} running job {job_id}")
+            with self._running_lock:
+                self._running.add(job_id)
+            try:
+                result = asyncio.run(self.handler(job_id, request))
+                finished = self.store.complete(job_id, self.owner, result)
+            except Exception as e:
+                traceback.print_exc()
+                finished = self.store.fail(job_id, self.owner, str(e))
+            finally:
+                with self._running_lock:
+                    self._running.discard(job_id)
+            if not finished:
+                print(f"Research job {job_id} was taken over by another worker, dropping its outcome")
@@ -0,0 +1,317 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import os
+import threading
+import time
+
+from .backends import LLMResponse, create_backend
+from .metrics import CIRCUIT_REJECTIONS, MODEL_HEDGES, MODEL_RETRIES
+from .resilience import CircuitOpenError, RetryPolicy, get_circuit_breaker, get_hedger, is_retryable
+from .scheduler import Priority, estimate_tokens, get_scheduler
+from .usage import CallLimitExceeded
+
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide executor that runs blocking backend calls"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = int(os.getenv("GEMINI_MAX_WORKERS", "32"))
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix="gemini",
+            )
+        return _executor
+
+
+def _usage(raw: dict) -> dict:
+    return (raw or {}).get("usage_metadata") or {}
+
+
+def _total_tokens(raw: dict) -> int:
+    return _usage(raw).get("total_token_count") or 0
+
+
+class LLMClient:
+    """
+    Async facade over a model backend (see src/backends.py).
+
+    Backend calls are blocking, so each one is dispatched onto a bounded,
+    process-wide thread pool. Awaiting them lets concurrent research branches
+    overlap their network latency instead of running one after another, and
+    keeps the event loop free for other requests.
+
+    Every call is first admitted by the shared RequestScheduler, which
+    enforces the per-model rate limits and serves higher priorities first.
+    When a RunLedger is given, each call is recorded in it under its phase.
+
+    Calls are guarded by the model's process-wide CircuitBreaker and
+    retried on retryable errors following `retry`. A non-streaming call
+    still running past the Hedger's latency percentile for its phase gets
+    a duplicate request, within the hedging budget, and the first response
+    wins. A streaming call is only retried before its first chunk. With a
+    ledger, calls past its max_calls are refused with CallLimitExceeded,
+    and retries and hedges only use calls the run doesn't plan to make.
+    """
+
+    def __init__(self, api_key: str, backend=None, ledger=None, retry: RetryPolicy = None):
+        self.api_key = api_key
+        self.backend = backend or create_backend(api_key)
+        self.scheduler = get_scheduler()
+        self.ledger = ledger
+        self.retry = retry or RetryPolicy(
+            max_retries=int(os.getenv("MODEL_MAX_RETRIES", "3")),
+            base_delay=float(os.getenv("MODEL_RETRY_BASE_DELAY", "0.5")),
+        )
+        self.hedger = get_hedger()
+
+    def _record(self, phase: str, model_name: str, prompt: str, text: str, raw: dict,
+                started: float, error: Exception = None):
+        if self.ledger is None:
+            return
+        usage = _usage(raw)
+        # Fall back to estimates when the backend reports no usage
+        prompt_tokens = usage.get("prompt_token_count") or estimate_tokens(prompt)
+        output_tokens = usage.get("candidates_token_count") or estimate_tokens(text)
+        self.ledger.record(
+            phase, model_name, prompt_tokens, output_tokens, time.monotonic() - started,
+            error=type(error).__name__ if error is not None else None,
+        )
+
+    def _start_call(self, extra: bool = False) -> bool:
+        """Count a call against the ledger's max_calls; `extra` is a retry or hedge"""
+        return self.ledger is None or self.ledger.start_call(extra)
+
+    def _release_call(self):
+        if self.ledger is not None:
+            self.ledger.release_call()
+
+    def _call_limit_error(self) -> CallLimitExceeded:
+        return CallLimitExceeded(f"Run reached its limit of {self.ledger.max_calls} model calls")
+
+    async def _admit(self, model_name: str, reserved: int, priority: int):
+        """Wait for the scheduler, giving back the counted call if the wait is cancelled"""
+        try:
+            await self.scheduler.acquire(model_name, reserved, priority)
+        except BaseException:
+            self._release_call()
+            raise
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _get_executor(), functools.partial(func, *args, **kwargs)
+        )
+
+    @staticmethod
+    def _check_circuit(model_name: str):
+        breaker = get_circuit_breaker(model_name)
+        try:
+            breaker.check()
+        except CircuitOpenError:
+            CIRCUIT_REJECTIONS.labels(model_name).inc()
+            raise
+        return breaker
+
+    async def _attempt(self, func, prompt: str, generation_config: dict, model_name: str, priority: int,
+                       phase: str, admitted: bool = False) -> LLMResponse:
+        """Make one counted backend call, admitted by the scheduler unless `admitted`"""
+        reserved = estimate_tokens(prompt)
+        if not admitted:
+            await self._admit(model_name, reserved, priority)
+        started = time.monotonic()
+        try:
+            response = await self._run(func, prompt, generation_config, model_name)
+        except BaseException as e:
+            # A cancelled call still runs to completion on the executor
+            self._record(phase, model_name, prompt, "", None, started, error=e)
+            raise
+        self._record(phase, model_name, prompt, response.text, response.raw, started)
+        self.hedger.observe(phase, model_name, time.monotonic() - started)
+        actual = _total_tokens(response.raw)
+        if actual:
+            self.scheduler.settle(model_name, reserved, actual)
+        return response
+
+    async def _hedged(self, func, prompt: str, generation_config: dict, model_name: str, priority: int,
+                      phase: str) -> LLMResponse:
+        """Make a counted call, sending a duplicate if it runs past the hedging latency"""
+        await self._admit(model_name, estimate_tokens(prompt), priority)
+        args = (func, prompt, generation_config, model_name, priority, phase)
+        primary = asyncio.ensure_future(self._attempt(*args, admitted=True))
+        delay = self.hedger.delay(phase, model_name)
+        if delay is None:
+            return await primary
+
+        attempts = {primary: "primary"}
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done and self._start_call(extra=True):
+                if self.hedger.try_spend():
+                    attempts[asyncio.ensure_future(self._attempt(*args))] = "hedge"
+                else:
+                    self._release_call()
+
+            error = None
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if len(attempts) > 1:
+                            MODEL_HEDGES.labels(phase, attempts[attempt]).inc()
+                        for loser in pending:
+                            # Let the slower request finish so its usage is still recorded
+                            loser.add_done_callback(lambda task: task.cancelled() or task.exception())
+                        return attempt.result()
+                    error = error or attempt.exception()
+            raise error
+        except asyncio.CancelledError:
+            for attempt in attempts:
+                attempt.cancel()
+            raise
+
+    async def _call(self, func, prompt: str, generation_config: dict, model_name: str, priority: int,
+                    phase: str) -> LLMResponse:
+        retries = 0
+        error = None
+        while True:
+            breaker = self._check_circuit(model_name)
+            if not self._start_call(extra=retries > 0):
+                raise error or self._call_limit_error()
+            try:
+                response = await self._hedged(func, prompt, generation_config, model_name, priority, phase)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                breaker.record_failure()
+                if retries >= self.retry.max_retries:
+                    raise
+                error = e
+                MODEL_RETRIES.labels(phase).inc()
+                await asyncio.sleep(self.retry.delay(retries))
+                retries += 1
+                continue
+            breaker.record_success()
+            return response
+
+    async def generate(
+        self,
+        prompt: str,
+        generation_config: dict,
+        model_name: str = DEFAULT_MODEL,
+        priority: int = Priority.BULK,
+        phase: str = "generate",
+    ) -> LLMResponse:
+        """Run a plain (optionally structured-output) generation"""
+        return await self._call(self.backend.generate, prompt, generation_config, model_name, priority, phase)
+
+    async def generate_grounded(
+        self,
+        prompt: str,
+        generation_config: dict,
+        model_name: str = DEFAULT_MODEL,
+        priority: int = Priority.BULK,
+        phase: str = "grounded",
+    ) -> LLMResponse:
+        """Run a generation grounded with the Google Search tool"""
+        return await self._call(self.backend.generate_grounded, prompt, generation_config, model_name, priority, phase)
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        generation_config: dict,
+        model_name: str = DEFAULT_MODEL,
+        priority: int = Priority.BULK,
+        phase: str = "stream",
+    ):
+        """
+        Run a generation and yield its chunks as LLMResponse objects as soon
+        as the model produces them.
+        """
+        retries = 0
+        error = None
+        while True:
+            breaker = self._check_circuit(model_name)
+            if not self._start_call(extra=retries > 0):
+                raise error or self._call_limit_error()
+            started = False
+            try:
+                async for chunk in self._stream_once(prompt, generation_config, model_name, priority, phase):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                breaker.record_failure()
+                # Chunks already handed out can't be taken back
+                if started or retries >= self.retry.max_retries:
+                    raise
+                error = e
+                MODEL_RETRIES.labels(phase).inc()
+                await asyncio.sleep(self.retry.delay(retries))
+                retries += 1
+                continue
+            breaker.record_success()
+            return
+
+    async def _stream_once(self, prompt: str, generation_config: dict, model_name: str, priority: int, phase: str):
+        reserved = estimate_tokens(prompt)
+        await self._admit(model_name, reserved, priority)
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stopped = threading.Event()
+        finished = object()
+
+        def emit(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # The consumer's event loop is gone
+                stopped.set()
+
+        def produce():
+            try:
+                for chunk in self.backend.generate_stream(prompt, generation_config, model_name):
+                    if stopped.is_set():
+                        break
+                    emit(chunk)
+            except Exception as e:
+                emit(e)
+            finally:
+                emit(finished)
+
+        started = time.monotonic()
+        loop.run_in_executor(_get_executor(), produce)
+
+        actual = 0
+        last_raw = None
+        text_parts = []
+        error = None
+        try:
+            while True:
+                item = await queue.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    error = item
+                    raise item
+                if _total_tokens(item.raw):
+                    actual = _total_tokens(item.raw)
+                    last_raw = item.raw
+                text_parts.append(item.text)
+                yield item
+        finally:
+            # Let the producer thread stop early if the consumer gave up
+            stopped.set()
+            if actual:
+                self.scheduler.settle(model_name, reserved, actual)
+            self._record(phase, model_name, prompt, "".join(text_parts), last_raw, started, error=error)
@@ -0,0 +1,98 @@
+import contextlib
+import functools
+import inspect
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+
+# Model calls range from sub-second cache hits to multi-minute reports
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+PHASE_CALLS = Counter(
+    "deep_research_phase_calls_total",
+    "Research phase invocations",
+    ["phase"],
+)
+PHASE_LATENCY = Histogram(
+    "deep_research_phase_latency_seconds",
+    "Wall time of research phase invocations",
+    ["phase"],
+    buckets=LATENCY_BUCKETS,
+)
+PHASE_ERRORS = Counter(
+    "deep_research_phase_errors_total",
+    "Research phase invocations that raised, by exception class",
+    ["phase", "exception"],
+)
+TASKS_IN_FLIGHT = Gauge(
+    "deep_research_tasks_in_flight",
+    "Research phase invocations currently running",
+    ["phase"],
+)
+RUNS_IN_FLIGHT = Gauge(
+    "deep_research_runs_in_flight",
+    "Research runs currently in progress",
+)
+MODEL_RETRIES = Counter(
+    "deep_research_model_retries_total",
+    "Model calls repeated after a retryable error",
+    ["phase"],
+)
+MODEL_HEDGES = Counter(
+    "deep_research_model_hedges_total",
+    "Duplicate requests sent for slow model calls, by which request answered first",
+    ["phase", "winner"],
+)
+CIRCUIT_REJECTIONS = Counter(
+    "deep_research_circuit_rejections_total",
+    "Model calls failed fast because the model's circuit breaker was open",
+    ["model"],
+)
+COALESCED_REQUESTS = Counter(
+    "deep_research_coalesced_requests_total",
+    "API requests by how they were served: leader (computed), coalesced (joined an "
+    "in-flight computation) or reused (recent result)",
+    ["endpoint", "outcome"],
+)
+
+
+@contextlib.contextmanager
+def track_phase(phase: str):
+    """Count, time and record errors of the enclosed block under `phase`"""
+    in_flight = TASKS_IN_FLIGHT.labels(phase)
+    in_flight.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        PHASE_ERRORS.labels(phase, type(e).__name__).inc()
+        raise
+    finally:
+        in_flight.dec()
+        PHASE_CALLS.labels(phase).inc()
+        PHASE_LATENCY.labels(phase).observe(time.perf_counter() - started)
+
+
+def observe_phase(phase: str):
+    """Decorate a coroutine or async generator function with `track_phase`"""
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def generator_wrapper(*args, **kwargs):
+                with track_phase(phase):
+                    async for item in func(*args, **kwargs):
+                        yield item
+            return generator_wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track_phase(phase):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_metrics() -> tuple:
+    """Return the current metrics in the Prometheus text format and its content type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
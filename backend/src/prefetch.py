@@ -0,0 +1,64 @@
+import asyncio
+import time
+import uuid
+
+
+class PrefetchSessions:
+    """
+    Speculative first research levels, keyed by a session token.
+
+    `start` runs `DeepSearch.prefetch` in the background and hands out a
+    token; a later research request passes the token to `claim` and gets
+    the searches that finished by then. Sessions expire after `ttl_seconds`
+    and at most `max_sessions` are kept, oldest dropped first. Meant to be
+    used from a single event loop, like the API's.
+    """
+
+    def __init__(self, ttl_seconds: float = 600, max_sessions: int = 100):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions = {}  # token -> {"query", "created_at", "task", "searches"}
+
+    def _expire(self, room: int = 0):
+        cutoff = time.monotonic() - self.ttl_seconds
+        for token in [token for token, session in self._sessions.items() if session["created_at"] < cutoff]:
+            self._sessions.pop(token)["task"].cancel()
+        # Sessions are kept in creation order, so the first one is the oldest
+        while self._sessions and len(self._sessions) + room > self.max_sessions:
+            self._sessions.pop(next(iter(self._sessions)))["task"].cancel()
+
+    def start(self, deep_search, query: str, breadth: int) -> str:
+        """Start prefetching the first level of `query` and return its session token"""
+        self._expire(room=1)
+        token = str(uuid.uuid4())
+        searches = {}
+        task = asyncio.ensure_future(deep_search.prefetch(query, breadth, searches))
+        # The prefetch logs its own errors; don't leave them unretrieved
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._sessions[token] = {
+            "query": query,
+            "created_at": time.monotonic(),
+            "task": task,
+            "searches": searches,
+        }
+        return token
+
+    async def claim(self, token: str, wait_seconds: float = 0.0) -> dict:
+        """
+        Return the searches prefetched for `token`, query -> (text, sources),
+        waiting up to `wait_seconds` for the ones still running. The session
+        stays available to other requests until it expires.
+        """
+        self._expire()
+        session = self._sessions.get(token) if token else None
+        if session is None:
+            return {}
+        if wait_seconds > 0 and not session["task"].done():
+            await asyncio.wait({session["task"]}, timeout=wait_seconds)
+        return dict(session["searches"])
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "running": sum(1 for session in self._sessions.values() if not session["task"].done()),
+        }
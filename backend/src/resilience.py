@@ -0,0 +1,196 @@
+import collections
+import os
+import random
+import threading
+import time
+
+
+# HTTP statuses that signal a transient upstream problem
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+_RETRYABLE_NAMES = {"ConnectionError", "Timeout", "ChunkedEncodingError"}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a model whose circuit breaker is open"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed model call is worth repeating: connection problems and
+    timeouts (including SyntheticBackendError), and SDK errors carrying a
+    rate-limit or server-side status code. Invalid requests are not retried.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # google.api_core exceptions and google-genai's APIError expose the HTTP
+    # status as `code`
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS
+    # requests' connection errors and timeouts don't derive from the builtins
+    return any(cls.__name__ in _RETRYABLE_NAMES for cls in type(error).__mro__)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: retry n waits a uniformly random
+    time between 0 and min(max_delay, base_delay * 2**n), which spreads out
+    retries from many concurrent branches hitting the same outage.
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0, rng: random.Random = None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = rng or random.Random()
+
+    def delay(self, retry: int) -> float:
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while an upstream model is degraded.
+
+    After `failure_threshold` consecutive retryable failures the circuit
+    opens and calls raise CircuitOpenError. Every `reset_seconds` one call
+    is let through as a probe; a success closes the circuit again, a
+    failure keeps it open for another period. Errors that say nothing about
+    upstream health, such as invalid requests, are not counted.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def check(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_seconds:
+                # Let this call probe the upstream and hold the others back
+                self._opened_at = now
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"Circuit for {self.name} is open after repeated upstream failures")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold and self._opened_at is None:
+                self._opened_at = time.monotonic()
+                print(f"Opening circuit for {self.name} after {self.failures} consecutive failures")
+
+    def stats(self) -> dict:
+        return {"open": self.is_open, "consecutive_failures": self.failures, "rejected": self.rejected}
+
+
+class Hedger:
+    """
+    Decides when a slow model call gets a duplicate request.
+
+    Latencies of successful calls are kept per (phase, model) over a sliding
+    window. Once `min_samples` are known, a call still running past the
+    `percentile` latency may be hedged, as long as hedges stay within
+    `budget` (a fraction) of all calls, which bounds the extra cost.
+    """
+
+    def __init__(self, percentile: float = 0.95, budget: float = 0.1, min_samples: int = 20, window: int = 200):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.window = window
+        self.calls = 0
+        self.hedges = 0
+        self._latencies = {}  # (phase, model) -> deque of recent latencies
+        self._lock = threading.Lock()
+
+    def observe(self, phase: str, model_name: str, latency: float):
+        with self._lock:
+            latencies = self._latencies.get((phase, model_name))
+            if latencies is None:
+                latencies = self._latencies[(phase, model_name)] = collections.deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def delay(self, phase: str, model_name: str):
+        """Seconds after which a call should be hedged, or None to not hedge it"""
+        with self._lock:
+            self.calls += 1
+            if not 0 < self.percentile < 1:
+                return None
+            latencies = self._latencies.get((phase, model_name))
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def try_spend(self) -> bool:
+        """Take a hedge out of the budget, if one is left"""
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "hedges": self.hedges, "budget": self.budget, "percentile": self.percentile}
+
+
+_breakers = {}
+_hedger = None
+_lock = threading.Lock()
+
+
+def get_circuit_breaker(model_name: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker of a model"""
+    with _lock:
+        breaker = _breakers.get(model_name)
+        if breaker is None:
+            breaker = _breakers[model_name] = CircuitBreaker(
+                model_name,
+                failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+                reset_seconds=float(os.getenv("CIRCUIT_RESET_SECONDS", "30")),
+            )
+        return breaker
+
+
+def get_hedger() -> Hedger:
+    """Return the process-wide hedger, configured by HEDGE_PERCENTILE and HEDGE_BUDGET"""
+    global _hedger
+    with _lock:
+        if _hedger is None:
+            _hedger = Hedger(
+                percentile=float(os.getenv("HEDGE_PERCENTILE", "0.95")),
+                budget=float(os.getenv("HEDGE_BUDGET", "0.1")),
+                min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+            )
+        return _hedger
+
+
+def resilience_stats() -> dict:
+    """Circuit breaker state per model and hedging counters"""
+    with _lock:
+        breakers = dict(_breakers)
+    return {
+        "circuits": {name: breaker.stats() for name, breaker in breakers.items()},
+        "hedging": get_hedger().stats(),
+    }
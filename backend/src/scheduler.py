@@ -0,0 +1,238 @@
+from enum import IntEnum
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class Priority(IntEnum):
+    """Scheduling classes, lower values are served first"""
+    INTERACTIVE = 0  # user is waiting on the answer (follow-up questions, planning)
+    REPORT = 1  # final report synthesis
+    BULK = 2  # search fan-out and result processing
+
+
+DEFAULT_RPM = int(os.getenv("GEMINI_RPM", "2000"))
+DEFAULT_TPM = int(os.getenv("GEMINI_TPM", "4000000"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate used to reserve TPM capacity before a call"""
+    return max(1, len(text) // 4)
+
+
+class _TokenBucket:
+    """Per-minute limit refilled continuously; a limit of 0 disables it"""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if it can be taken now)"""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "loop", "event", "tokens")
+
+    def __init__(self, priority: int, seq: int, loop, event: asyncio.Event, tokens: int):
+        self.priority = priority
+        self.seq = seq
+        self.loop = loop
+        self.event = event
+        self.tokens = tokens
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # The waiter's event loop has already been closed
+            pass
+
+
+class _ModelQueue:
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = _TokenBucket(rpm)
+        self.token_bucket = _TokenBucket(tpm)
+        self.waiters = []
+        self.granted = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.granted_by_priority = {p.name: 0 for p in Priority}
+
+    def try_take(self, tokens: int) -> float:
+        now = time.monotonic()
+        delay = max(
+            self.requests.delay_for(1, now),
+            self.token_bucket.delay_for(tokens, now),
+        )
+        if delay == 0:
+            self.requests.take(1)
+            self.token_bucket.take(tokens)
+        return delay
+
+    def record_grant(self, priority: int, wait: float):
+        self.granted += 1
+        self.granted_by_priority[Priority(priority).name] += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait > 0.001:
+            self.throttled += 1
+
+    def wake_head(self):
+        if self.waiters:
+            self.waiters[0].wake()
+
+    def stats(self) -> dict:
+        depth_by_priority = {p.name: 0 for p in Priority}
+        for ticket in self.waiters:
+            depth_by_priority[Priority(ticket.priority).name] += 1
+        return {
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "queue_depth": len(self.waiters),
+            "queue_depth_by_priority": depth_by_priority,
+            "granted": self.granted,
+            "granted_by_priority": dict(self.granted_by_priority),
+            "throttled": self.throttled,
+            "avg_wait_seconds": self.total_wait / self.granted if self.granted else 0.0,
+            "max_wait_seconds": self.max_wait,
+        }
+
+
+class RequestScheduler:
+    """
+    Process-wide admission control for model calls.
+
+    Each model gets a requests-per-minute and a tokens-per-minute bucket.
+    Callers queue in priority order and are admitted once both buckets have
+    capacity, so traffic at the quota ceiling is smoothed into waiting
+    instead of failing with quota errors. The scheduler is thread-safe and
+    can be shared by coroutines running on different event loops.
+    """
+
+    def __init__(self, limits: dict = None, default_rpm: int = DEFAULT_RPM, default_tpm: int = DEFAULT_TPM):
+        self.limits = limits or {}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+
+    def _queue(self, model: str) -> _ModelQueue:
+        with self._lock:
+            queue = self._queues.get(model)
+            if queue is None:
+                limit = self.limits.get(model, {})
+                queue = _ModelQueue(
+                    int(limit.get("rpm", self.default_rpm)),
+                    int(limit.get("tpm", self.default_tpm)),
+                )
+                self._queues[model] = queue
+            return queue
+
+    async def acquire(self, model: str, tokens: int = 0, priority: int = Priority.BULK) -> float:
+        """Wait until a call to `model` may be issued; returns seconds waited"""
+        queue = self._queue(model)
+        ticket = _Ticket(priority, next(self._seq), asyncio.get_running_loop(), asyncio.Event(), tokens)
+        enqueued_at = time.monotonic()
+        with self._lock:
+            heapq.heappush(queue.waiters, ticket)
+
+        granted = False
+        try:
+            while True:
+                delay = None
+                with self._lock:
+                    if queue.waiters[0] is ticket:
+                        delay = queue.try_take(tokens)
+                        if delay == 0:
+                            heapq.heappop(queue.waiters)
+                            granted = True
+                            wait = time.monotonic() - enqueued_at
+                            queue.record_grant(priority, wait)
+                            queue.wake_head()
+                            return wait
+
+                ticket.event.clear()
+                if delay is None:
+                    # Not at the head of the queue, wait to be woken up
+                    await ticket.event.wait()
+                else:
+                    # At the head but out of capacity, sleep until refill unless
+                    # woken earlier (e.g. by a refund)
+                    try:
+                        await asyncio.wait_for(ticket.event.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            if not granted:
+                with self._lock:
+                    was_head = queue.waiters and queue.waiters[0] is ticket
+                    queue.waiters.remove(ticket)
+                    heapq.heapify(queue.waiters)
+                    if was_head:
+                        queue.wake_head()
+
+    def settle(self, model: str, reserved_tokens: int, actual_tokens: int):
+        """Correct a reservation once the real token usage of a call is known"""
+        queue = self._queue(model)
+        with self._lock:
+            if actual_tokens < reserved_tokens:
+                queue.token_bucket.refund(reserved_tokens - actual_tokens)
+                queue.wake_head()
+            elif actual_tokens > reserved_tokens:
+                queue.token_bucket.take(actual_tokens - reserved_tokens)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {model: queue.stats() for model, queue in self._queues.items()}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """
+    Return the shared scheduler. Per-model limits can be configured with
+    GEMINI_RATE_LIMITS, e.g. '{"gemini-2.0-flash": {"rpm": 2000, "tpm": 4000000}}',
+    and GEMINI_RPM / GEMINI_TPM set the defaults for other models.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(json.loads(os.getenv("GEMINI_RATE_LIMITS", "{}")))
+        return _scheduler
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different spellings share a cache entry"""
+    query = query.lower().strip()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" .?!,;:\"'")
+
+
+class SearchCache:
+    """
+    SQLite-backed cache of grounded search results.
+
+    Entries are keyed by the normalized query and the model, expire after
+    `ttl_seconds` and are evicted least-recently-used first once the cache
+    holds more than `max_entries` rows.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 6 * 3600, max_entries: int = 10000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS search_results (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                query TEXT NOT NULL,
+                text TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS search_results_accessed ON search_results (accessed_at)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(query: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, query: str, model: str):
+        """Return the cached (formatted_text, sources) tuple or None"""
+        key = self._key(query, model)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, sources, created_at FROM search_results WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            text, sources, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM search_results WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE search_results SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+
+        # JSON object keys are strings, restore the integer source indices
+        return text, {int(i): source for i, source in json.loads(sources).items()}
+
+    def put(self, query: str, model: str, text: str, sources: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(query, model), model, query, text, json.dumps(sources), now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM search_results").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    """
+                    DELETE FROM search_results WHERE key IN (
+                        SELECT key FROM search_results ORDER BY accessed_at LIMIT ?
+                    )
+                    """,
+                    (overflow,),
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM search_results").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
+
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    """Return the process-wide search cache configured from the environment"""
+    global _search_cache
+    with _search_cache_lock:
+        if _search_cache is None:
+            _search_cache = SearchCache(
+                os.getenv("SEARCH_CACHE_PATH", os.path.join(".cache", "search_cache.sqlite3")),
+                ttl_seconds=float(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600))),
+                max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "10000")),
+            )
+        return _search_cache
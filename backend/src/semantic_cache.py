@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from .text_similarity import HashingVectorizer, normalize_text, specifics_compatible
+
+
+class SemanticCache:
+    """
+    In-memory cache of structured model responses looked up by similarity.
+
+    Prompts are embedded with a HashingVectorizer and kept in a fixed-size
+    matrix, so a lookup is one matrix-vector product. A stored response is
+    reused when the most similar prompt in the same namespace reaches
+    `threshold` cosine similarity and names the same numbers and words, up
+    to stopwords and inflection. An optional `context`, such as a user's
+    follow-up answers, is never matched approximately: only entries stored
+    with the same normalized context can be returned. Entries expire after
+    `ttl_seconds` and the least recently used entry is overwritten once
+    `capacity` is reached.
+    """
+
+    def __init__(self, capacity: int = 1024, threshold: float = 0.9, ttl_seconds: float = 3600,
+                 vectorizer: HashingVectorizer = None):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.vectorizer = vectorizer or HashingVectorizer()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._vectors = np.zeros((capacity, self.vectorizer.dimensions), dtype=np.float32)
+        self._namespaces = np.full(capacity, -1, dtype=np.int64)
+        self._contexts = np.zeros(capacity, dtype=np.int64)
+        self._created = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._values = [None] * capacity
+        self._prompts = [None] * capacity
+        self._exact = {}  # (namespace id, normalized prompt digest) -> slot
+        self._slot_keys = [None] * capacity
+        self._namespace_ids = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _namespace_id(self, namespace: str) -> int:
+        if namespace not in self._namespace_ids:
+            self._namespace_ids[namespace] = len(self._namespace_ids)
+        return self._namespace_ids[namespace]
+
+    @staticmethod
+    def _digest(prompt: str) -> str:
+        return hashlib.sha1(normalize_text(prompt).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _context_id(cls, context: str) -> int:
+        return int(cls._digest(context)[:15], 16)
+
+    def get(self, namespace: str, prompt: str, context: str = ""):
+        """Return a cached response for a similar prompt with the same context, or None"""
+        now = time.time()
+        with self._lock:
+            ns = self._namespace_id(namespace)
+            context_id = self._context_id(context)
+            slot = self._exact.get((ns, context_id, self._digest(prompt)))
+            if slot is None and self._size:
+                vector = self.vectorizer.embed(prompt)
+                scores = self._vectors[:self._size] @ vector
+                mismatched = (self._namespaces[:self._size] != ns) | (self._contexts[:self._size] != context_id)
+                scores[mismatched] = -1.0
+                # Similar prompts about a different year or place are not a hit
+                for candidate in np.argsort(-scores):
+                    if scores[candidate] < self.threshold:
+                        break
+                    if specifics_compatible(prompt, self._prompts[candidate]):
+                        slot = int(candidate)
+                        break
+
+            if slot is None or now - self._created[slot] > self.ttl_seconds:
+                self.misses += 1
+                return None
+
+            self._last_used[slot] = now
+            self.hits += 1
+            value = self._values[slot]
+
+        # Stored as JSON so callers never share mutable state
+        return json.loads(value)
+
+    def put(self, namespace: str, prompt: str, value, context: str = ""):
+        now = time.time()
+        vector = self.vectorizer.embed(prompt)
+        with self._lock:
+            ns = self._namespace_id(namespace)
+            context_id = self._context_id(context)
+            key = (ns, context_id, self._digest(prompt))
+            slot = self._exact.get(key)
+            if slot is None:
+                if self._size < self.capacity:
+                    slot = self._size
+                    self._size += 1
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    self._exact.pop(self._slot_keys[slot], None)
+                    self.evictions += 1
+
+            self._vectors[slot] = vector
+            self._namespaces[slot] = ns
+            self._contexts[slot] = context_id
+            self._created[slot] = now
+            self._last_used[slot] = now
+            self._values[slot] = json.dumps(value)
+            self._prompts[slot] = prompt
+            self._slot_keys[slot] = key
+            self._exact[key] = slot
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """Return the process-wide planning cache configured from the environment"""
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache(
+                capacity=int(os.getenv("SEMANTIC_CACHE_CAPACITY", "1024")),
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9")),
+                ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+            )
+        return _semantic_cache
@@ -0,0 +1,120 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+# Query parameters that only track where a click came from
+_TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "mc_cid", "mc_eid", "ref", "ref_src"}
+_DEFAULT_PORTS = {"http": "80", "https": "443"}
+# Bare source numbers written by the model, e.g. [3] or [2, 5], that are not already links
+_CITATION = re.compile(r"(?<!\[)\[(\d+(?:\s*,\s*\d+)*)\](?![\](])")
+# A citation that may still be completed by the next streamed chunk
+_PARTIAL_CITATION = re.compile(r"\[[\d,\s]*\]?\Z")
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a URL so that trivially different spellings of the same page
+    compare equal: lowercase scheme and host, no default port, "www." or
+    fragment, no tracking parameters, sorted query and no trailing slash.
+    """
+    url = url.strip()
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return url
+
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    netloc = host
+    if parts.port is not None and str(parts.port) != _DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in _TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/")
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+
+class SourceRegistry:
+    """
+    Per-run table of sources with stable citation ids.
+
+    Every URL is interned under its canonical form, so the same page found
+    by different searches gets one id. Ids start at 1 and are handed out in
+    insertion order; they are the numbers used for citations in the report
+    and in its Sources section. A registry can be seeded with an existing
+    id -> source dict, such as the visited_urls returned by deep_research.
+    """
+
+    def __init__(self, visited_urls: dict[int, dict] = None):
+        self._ids = {}  # Canonical URL -> id
+        self._sources = {}  # id -> {"id", "link", "title"}
+        self._next_id = 1
+        for source_id, source in (visited_urls or {}).items():
+            key = canonicalize_url(source["link"])
+            if key not in self._ids:
+                self._ids[key] = source_id
+                self._sources[source_id] = {"id": source_id, "link": source["link"], "title": source.get("title", "")}
+                self._next_id = max(self._next_id, source_id + 1)
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+    def add(self, link: str, title: str = "") -> int:
+        """Return the id of `link`, registering it if it is new"""
+        key = canonicalize_url(link)
+        source_id = self._ids.get(key)
+        if source_id is None:
+            source_id = self._next_id
+            self._next_id += 1
+            self._ids[key] = source_id
+            self._sources[source_id] = {"id": source_id, "link": link, "title": title}
+        elif title and not self._sources[source_id]["title"]:
+            self._sources[source_id]["title"] = title
+        return source_id
+
+    def add_many(self, sources) -> list[int]:
+        """Register {"link", "title"} dicts and return their ids"""
+        return [self.add(source["link"], source.get("title", "")) for source in sources if source.get("link")]
+
+    def get(self, source_id: int) -> dict:
+        return self._sources.get(source_id)
+
+    def id_for(self, link: str) -> int:
+        return self._ids.get(canonicalize_url(link))
+
+    def as_dict(self) -> dict[int, dict]:
+        """Sources keyed by id, in the visited_urls shape used by the report"""
+        return {
+            source_id: {"link": source["link"], "title": source["title"]}
+            for source_id, source in self._sources.items()
+        }
+
+
+def link_citations(text: str, visited_urls: dict[int, dict]) -> str:
+    """Turn the model's bare source numbers, e.g. [3] or [2, 5], into [[n]](link) citations"""
+    def replace(match):
+        links = []
+        for number in match.group(1).split(","):
+            source = visited_urls.get(int(number))
+            if source is None:
+                return match.group(0)
+            links.append(f"[[{int(number)}]]({source['link']})")
+        return "".join(links)
+
+    return _CITATION.sub(replace, text)
+
+
+def split_partial_citation(text: str) -> tuple:
+    """
+    Split streamed text into the part that can be linked now and a trailing
+    fragment such as "[1, " that the next chunk may turn into a citation.
+    """
+    start = text.rfind("[")
+    if start == -1 or _PARTIAL_CITATION.match(text, start) is None:
+        return text, ""
+    return text[:start], text[start:]
@@ -0,0 +1,230 @@
+import re
+import zlib
+
+import numpy as np
+
+
+DEFAULT_DIMENSIONS = 1024
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    # Apostrophes join their word, so "what's" and "whats" compare equal
+    text = re.sub(r"['\u2019]", "", text.lower())
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class HashingVectorizer:
+    """
+    Offline text embedding based on hashed word and character n-grams.
+
+    Features are hashed into a fixed number of signed buckets and the
+    resulting vectors are L2-normalized, so the cosine similarity of two
+    texts is a plain dot product. No vocabulary has to be fitted and the
+    output is deterministic across processes.
+    """
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS, ngram_range: tuple = (3, 5)):
+        if dimensions & (dimensions - 1):
+            raise ValueError("dimensions must be a power of two")
+        self.dimensions = dimensions
+        self.ngram_range = ngram_range
+        self._mask = dimensions - 1
+
+    def _features(self, text: str) -> list:
+        text = normalize_text(text)
+        features = text.split()
+        padded = f" {text} "
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        features = self._features(text)
+        if not features:
+            return vector
+
+        hashes = np.fromiter(
+            (zlib.crc32(f.encode("utf-8")) for f in features),
+            dtype=np.uint32,
+            count=len(features),
+        )
+        buckets = (hashes & self._mask).astype(np.intp)
+        # Use the top bit as a sign so collisions tend to cancel out
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, buckets, signs)
+
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector
+
+    def embed_many(self, texts) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            matrix[i] = self.embed(text)
+        return matrix
+
+
+class SimilarityIndex:
+    """
+    Growing set of embedded texts for batched near-duplicate checks.
+
+    Vectors live in a single NumPy matrix that doubles in size as needed, so
+    checking a batch of candidates against everything indexed so far is one
+    matrix product.
+    """
+
+    def __init__(self, threshold: float = 0.8, vectorizer: HashingVectorizer = None, initial_capacity: int = 64):
+        self.threshold = threshold
+        self.vectorizer = vectorizer or HashingVectorizer()
+        self.texts = []
+        self._vectors = np.zeros((initial_capacity, self.vectorizer.dimensions), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def _append(self, texts: list, vectors: np.ndarray):
+        needed = len(self.texts) + len(texts)
+        if needed > len(self._vectors):
+            grown = np.zeros((max(needed, 2 * len(self._vectors)), self.vectorizer.dimensions), dtype=np.float32)
+            grown[:len(self.texts)] = self._vectors[:len(self.texts)]
+            self._vectors = grown
+        self._vectors[len(self.texts):needed] = vectors
+        self.texts.extend(texts)
+
+    def add(self, texts: list):
+        if texts:
+            self._append(list(texts), self.vectorizer.embed_many(texts))
+
+    def filter_new(self, candidates: list, threshold: float = None) -> list:
+        """
+        Return the candidates that are not near-duplicates of an indexed text
+        or of an earlier candidate in the same batch. Order is preserved.
+        """
+        if not candidates:
+            return []
+        threshold = self.threshold if threshold is None else threshold
+        vectors = self.vectorizer.embed_many(candidates)
+
+        keep = np.ones(len(candidates), dtype=bool)
+        if self.texts:
+            history_scores = vectors @ self._vectors[:len(self.texts)].T
+            keep &= history_scores.max(axis=1) < threshold
+
+        batch_scores = vectors @ vectors.T
+        for i in range(1, len(candidates)):
+            if keep[i] and (batch_scores[i, :i][keep[:i]] >= threshold).any():
+                keep[i] = False
+
+        return [candidate for candidate, kept in zip(candidates, keep) if kept]
+
+    def recent(self, limit: int) -> list:
+        return self.texts[-limit:]
+
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def information_density(text: str) -> int:
+    """Distinct words plus distinct numbers, which carry most of a finding's specifics"""
+    return len(set(normalize_text(text).split())) + len(set(_NUMBER.findall(text)))
+
+
+_STOPWORDS = frozenset(
+    "a about an and are as at be been by can could did do does for from had has have how in is it its of on or "
+    "should so than that the their there these this to was were what when where which who why "
+    "will with would".split()
+)
+
+
+def _same_word(a: str, b: str) -> bool:
+    """Equal words, or inflections of one another such as "effect" and "effects" """
+    if a == b:
+        return True
+    if a.isdigit() or b.isdigit():
+        return False
+    short, long = sorted((a, b), key=len)
+    return len(short) >= 4 and len(long) - len(short) <= 3 and long.startswith(short)
+
+
+def specifics_compatible(a: str, b: str) -> bool:
+    """
+    Whether two similar texts name the same specifics: every number and
+    every word other than a stopword must appear in both, up to inflection.
+    Hashed n-grams score "jobs in California" and "jobs in Texas" (or two
+    different years) as near-identical; this tells them apart.
+    """
+    words_a = set(normalize_text(a).split()) - _STOPWORDS
+    words_b = set(normalize_text(b).split()) - _STOPWORDS
+    if set(_NUMBER.findall(a)) != set(_NUMBER.findall(b)):
+        return False
+    return (all(any(_same_word(word, other) for other in words_b) for word in words_a)
+            and all(any(_same_word(word, other) for other in words_a) for word in words_b))
+
+
+def consolidate(texts: list, sources: list, threshold: float = 0.75, vectorizer: HashingVectorizer = None) -> list:
+    """
+    Merge near-duplicate texts, e.g. the same finding phrased differently by
+    sibling research branches.
+
+    Texts are visited from most to least information-dense; each one joins
+    the first cluster whose representative it reaches `threshold` cosine
+    similarity with, unless the two quote different numbers, and otherwise
+    starts a cluster of its own. `sources[i]` lists the sources of
+    `texts[i]`. Returns (representative, sources) pairs in the order the
+    representatives were given, with each cluster's sources unioned.
+    """
+    if not texts:
+        return []
+    vectorizer = vectorizer or HashingVectorizer()
+    scores = vectorizer.embed_many(texts)
+    scores = scores @ scores.T
+    numbers = [set(_NUMBER.findall(text)) for text in texts]
+
+    order = sorted(range(len(texts)), key=lambda i: (-information_density(texts[i]), i))
+    leaders = []
+    members = {}
+    for i in order:
+        for leader in leaders:
+            compatible = numbers[i] <= numbers[leader] or numbers[leader] <= numbers[i]
+            if compatible and scores[i, leader] >= threshold:
+                members[leader].append(i)
+                break
+        else:
+            leaders.append(i)
+            members[i] = [i]
+
+    clusters = []
+    for leader in sorted(leaders):
+        merged = {}
+        for i in members[leader]:
+            merged.update(dict.fromkeys(sources[i]))
+        clusters.append((texts[leader], list(merged)))
+    return clusters
+
+
+def match_texts(texts: list, candidates: list, threshold: float, vectorizer: HashingVectorizer = None) -> dict:
+    """
+    Pair texts with their most similar candidate at or above `threshold`
+    cosine similarity, using every candidate at most once and the closest
+    pairs first. Returns a text index -> candidate index dict.
+    """
+    if not texts or not candidates:
+        return {}
+    vectorizer = vectorizer or HashingVectorizer()
+    scores = vectorizer.embed_many(texts) @ vectorizer.embed_many(candidates).T
+
+    matches = {}
+    used = set()
+    for flat in np.argsort(-scores, axis=None):
+        i, j = divmod(int(flat), len(candidates))
+        if scores[i, j] < threshold:
+            break
+        if i not in matches and j not in used:
+            matches[i] = j
+            used.add(j)
+    return matches
@@ -0,0 +1,133 @@
+import contextvars
+import time
+
+
+# Research tree node (query string, or list of queries for a batched call)
+# that LLM calls made in the current task are attributed to
+current_node = contextvars.ContextVar("current_node", default=None)
+
+
+class CallLimitExceeded(RuntimeError):
+    """Raised instead of making a model call past the run's max_calls"""
+
+
+class RunLedger:
+    """
+    Usage of a single research run with optional hard limits.
+
+    LLMClient records every call with its phase, model, prompt and output
+    tokens, latency and the tree node it was made for. deep_research checks
+    `fits` before spending more and prunes the tree instead, so the final
+    report can still be written within `max_calls`, `max_tokens` and
+    `max_seconds` (wall clock since the ledger was created). `max_calls` is
+    also enforced per call: LLMClient counts each call with `start_call`
+    before making it and refuses the calls that don't fit. Retries and
+    hedges only get the calls left beyond those the run still `plan`s.
+    """
+
+    def __init__(self, max_calls: int = None, max_tokens: int = None, max_seconds: float = None):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.started_at = time.monotonic()
+        self.records = []
+        self.calls = 0
+        self.in_flight = 0  # Calls started but not recorded yet
+        self.planned = 0  # First attempts the run still expects to make
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.pruned = 0
+
+    def record(self, phase: str, model: str, prompt_tokens: int, output_tokens: int,
+               latency: float, error: str = None):
+        self.records.append({
+            "phase": phase,
+            "model": model,
+            "node": current_node.get(),
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "latency": latency,
+            "error": error,
+        })
+        self.calls += 1
+        self.in_flight = max(0, self.in_flight - 1)
+        self.prompt_tokens += prompt_tokens
+        self.output_tokens += output_tokens
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.output_tokens
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def plan(self, calls: int):
+        """Set how many first attempts of model calls the run still expects to make"""
+        self.planned = calls
+
+    def start_call(self, extra: bool = False) -> bool:
+        """Count a call about to be made if it fits; `extra` is a retry or hedge"""
+        needed = self.calls + self.in_flight + 1 + (self.planned if extra else 0)
+        if self.max_calls is not None and needed > self.max_calls:
+            return False
+        if not extra:
+            self.planned = max(0, self.planned - 1)
+        self.in_flight += 1
+        return True
+
+    def release_call(self):
+        """Give back a call counted by start_call that was never made"""
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def fits(self, calls: int = 0, tokens: int = 0, seconds: float = 0.0) -> bool:
+        """Whether spending this much more stays within every limit"""
+        if self.max_calls is not None and self.calls + self.in_flight + calls > self.max_calls:
+            return False
+        if self.max_tokens is not None and self.tokens + tokens > self.max_tokens:
+            return False
+        if self.max_seconds is not None and self.elapsed() + seconds > self.max_seconds:
+            return False
+        return True
+
+    def cost_per_node(self) -> tuple:
+        """Average (calls, tokens) spent per research node so far"""
+        calls = 0.0
+        tokens = 0.0
+        nodes = set()
+        for record in self.records:
+            node = record["node"]
+            if node is None:
+                continue
+            # Batched calls are shared evenly by the nodes they served
+            shared = node if isinstance(node, list) else [node]
+            nodes.update(shared)
+            calls += 1 / len(shared)
+            tokens += (record["prompt_tokens"] + record["output_tokens"]) / len(shared)
+        if not nodes:
+            # Nothing measured yet: a search and an extraction per node
+            per_call = self.tokens / self.calls if self.calls else 0
+            return 2.0, 2 * per_call
+        return calls / len(nodes), tokens / len(nodes)
+
+    def totals(self) -> dict:
+        phases = {}
+        for record in self.records:
+            phase = phases.setdefault(record["phase"], {"calls": 0, "tokens": 0, "seconds": 0.0, "errors": 0})
+            phase["calls"] += 1
+            phase["tokens"] += record["prompt_tokens"] + record["output_tokens"]
+            phase["seconds"] += record["latency"]
+            phase["errors"] += record["error"] is not None
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "total_tokens": self.tokens,
+            "wall_seconds": self.elapsed(),
+            "pruned_queries": self.pruned,
+            "limits": {
+                "max_calls": self.max_calls,
+                "max_tokens": self.max_tokens,
+                "max_seconds": self.max_seconds,
+            },
+            "phases": phases,
+        }